@@ -1,8 +1,10 @@
-import subprocess
+import asyncio
+import logging
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 import aiohttp
+import jinja2
 from litestar import Litestar, Request, get
 from litestar.contrib.jinja import JinjaTemplateEngine
 from litestar.exceptions import HTTPException
@@ -11,15 +13,40 @@ from litestar.response import Redirect, Template
 from litestar.static_files import StaticFilesConfig
 from litestar.template.config import TemplateConfig
 
-from routes import files, frontend, music_badges, private
+import config
+from routes import assets, files, frontend, music_badges, private
+from utils import highlighter
+from utils.highlighter import HighlighterUnavailable
+from utils.deploy import on_stop_signal
+from utils.fragments import Fragments
 from utils.links import Links
+from utils.static_assets import static_assets
+from utils.timing import TimedTemplate, TimingMiddleware, metrics
+from utils.warmup import warmup
+from utils.weblog_index import weblog_index
+from utils.weblog_search import weblog_search
 from urllib.parse import quote_plus
 
+log = logging.getLogger(__name__)
+
+#  Compiled templates, shared by every worker and kept across restarts.
+TEMPLATES_CACHE = Path(".cache/templates")
+#  Whether edited templates are picked up without a restart, at a stat() per template per render.
+TEMPLATES_AUTO_RELOAD: bool = getattr(config, "TEMPLATES_AUTO_RELOAD", False)
+
 
 def register_engine_callables(engine: JinjaTemplateEngine):
     engine.register_template_callable("navbar", frontend.navbar)
 
-    engine.engine.globals.update(links=Links)
+    TEMPLATES_CACHE.mkdir(parents=True, exist_ok=True)
+    engine.engine.bytecode_cache = jinja2.FileSystemBytecodeCache(str(TEMPLATES_CACHE))
+    engine.engine.auto_reload = TEMPLATES_AUTO_RELOAD
+    engine.engine.template_class = TimedTemplate
+    engine.engine.globals.update(
+        links=Links,
+        static_url=static_assets.url,
+        fragment=Fragments(engine.engine, static_assets),
+    )
     engine.engine.filters.update(quote=lambda s: quote_plus(s))
 
 
@@ -31,23 +58,74 @@ def handle_exception(request: Request, exc: HTTPException) -> Template:
     )
 
 
+async def warm_highlighter():
+    await highlighter.backend.start()
+    if not await highlighter.backend.wait_ready(timeout=30):
+        raise HighlighterUnavailable("No worker became ready, code will not be highlighted.")
+
+
+async def warm_galleries():
+    if await frontend.gallery_index.load():
+        # Opens the index and reads it into the page cache before the first visitor.
+        await asyncio.to_thread(frontend.list_gallery_folders)
+
+
+def load_templates(environment: jinja2.Environment):
+    for name in environment.list_templates(extensions=["html"]):
+        environment.get_template(name)
+
+
+async def warm_up(app: Litestar):
+    """Everything the first requests would otherwise wait for, see `utils.warmup`."""
+    started = asyncio.get_running_loop().time()
+    environment = app.template_engine.engine  # type: ignore
+    await warmup.step("templates", lambda: asyncio.to_thread(load_templates, environment))
+    await warmup.step("highlighter", warm_highlighter)
+    warmup.check("highlighter", highlighter.backend.is_ready)
+    await warmup.step("assets", lambda: asyncio.to_thread(static_assets.build))
+    await warmup.step("weblog", lambda: asyncio.to_thread(weblog_index.rebuild))
+    await warmup.step("search", lambda: asyncio.to_thread(weblog_search.refresh))
+    # Posts and gallery READMEs, rendered and highlighted. An export renders what it asks for.
+    if not app.state.get("exporting"):
+        await warmup.step("markdown", frontend.markdown_cache.refresh)
+    await warmup.step("galleries", warm_galleries)
+    warmup.finish(asyncio.get_running_loop().time() - started)
+
+
 @asynccontextmanager
 async def lifespan(app: Litestar):
     async with aiohttp.ClientSession() as session:
         app.state.session = session
-        p = subprocess.Popen(["node", "utils/shiki.js"])
+        await warm_up(app)
+        tasks = [
+            asyncio.create_task(weblog_index.watch()),
+            asyncio.create_task(weblog_search.run()),
+            asyncio.create_task(frontend.thumbnailer.run()),
+            asyncio.create_task(frontend.gallery_index.run()),
+            asyncio.create_task(frontend.now_playing.run(session)),
+            asyncio.create_task(metrics.run()),
+        ]
+        if not app.state.get("exporting"):
+            tasks.append(asyncio.create_task(frontend.markdown_cache.run()))
+        on_stop_signal(frontend.now_playing.close)
         yield
-        p.terminate()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        frontend.gallery_index.close()
+        await highlighter.backend.stop()
 
 
 app = Litestar(
     route_handlers=[
         music_badges.router,
+        assets.router,
         files.router,
         frontend.router,
         private.router,
     ],
     lifespan=[lifespan],
+    middleware=[TimingMiddleware()],
     exception_handlers={HTTPException: handle_exception},
     template_config=TemplateConfig(
         directory=Path("templates"),
@@ -0,0 +1,104 @@
+"""Builds a self-contained copy of the site to benchmark against.
+
+The work folder links to the app's code, templates and static files, and gets
+its own `config.py`, `weblog/`, `.cache/` and a files folder with galleries.
+Everything is generated from a fixed seed, so runs compare like with like.
+"""
+
+import random
+import shutil
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+REPO = Path(__file__).resolve().parent.parent
+LINKED = ["app.py", "routes", "utils", "templates", "static", "benchmarks"]
+#  Repository files copied into the files folder, to be shown by /code.
+CODE_FILES = ["app.py", "routes/frontend.py", "utils/highlighter.py", "static/styles/main.css"]
+WORDS = (
+    "the a of to and in is it that for on was with as at by this be from or an "
+    "server window cache python weblog music gallery browser request render thread "
+    "socket latency queue worker file image thumbnail syntax highlight feed poll"
+).split()
+SEED = 1000
+
+
+def paragraph(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def color(rng: random.Random) -> tuple[int, int, int]:
+    return rng.randrange(256), rng.randrange(256), rng.randrange(256)
+
+
+def build_weblog(folder: Path, rng: random.Random, posts: int):
+    code = (REPO / "utils/ttl_cache.py").read_text().splitlines()
+    for index in range(posts):
+        year = 2024 + index % 2
+        month, day = 1 + index % 12, 1 + index % 28
+        slug = f"{month:02}-{day:02}-benchmark-post-{index}"
+        start = rng.randrange(len(code) - 20)
+        body = "\n\n".join(paragraph(rng, rng.randint(40, 120)) for _ in range(8))
+        snippet = "\n".join(code[start : start + 20])
+        post = folder / str(year) / f"{slug}.md"
+        post.parent.mkdir(parents=True, exist_ok=True)
+        post.write_text(
+            f"# Benchmark post {index}\n\n{body}\n\n```py\n{snippet}\n```\n\n"
+            f"{paragraph(rng, 60)}\n\n```js\nconsole.log({index});\n```\n"
+        )
+
+
+def build_galleries(folder: Path, rng: random.Random, galleries: int, images: int):
+    for gallery in range(galleries):
+        target = folder / f"gallery{gallery}"
+        target.mkdir(parents=True, exist_ok=True)
+        (target / "README.md").write_text(f"Benchmark gallery {gallery}.\n\n{paragraph(rng, 30)}\n")
+        for index in range(images):
+            image = Image.new("RGB", (1600, 1200), color(rng))
+            draw = ImageDraw.Draw(image)
+            for _ in range(20):
+                x0, x1 = sorted(rng.randrange(1600) for _ in range(2))
+                y0, y1 = sorted(rng.randrange(1200) for _ in range(2))
+                draw.rectangle((x0, y0, x1, y1), fill=color(rng))
+            image.save(target / f"image{index:03}.jpg", quality=85)
+
+
+def build_files(folder: Path, lines: int):
+    for name in CODE_FILES:
+        target = folder / "code" / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(REPO / name, target)
+    # Big enough to be shown in several chunks.
+    source = (REPO / "routes/frontend.py").read_text().splitlines()
+    (folder / "code/big.py").write_text(
+        "\n".join(source[index % len(source)] for index in range(lines)) + "\n"
+    )
+
+
+def build(work: Path, posts: int, galleries: int, images: int, big_file_lines: int):
+    """Creates the work folder from scratch."""
+    if work.exists():
+        shutil.rmtree(work)
+    work.mkdir(parents=True)
+    for name in LINKED:
+        (work / name).symlink_to(REPO / name)
+
+    rng = random.Random(SEED)
+    build_weblog(work / "weblog", rng, posts)
+    build_galleries(work / "files/gallery", rng, galleries, images)
+    build_files(work / "files", big_file_lines)
+
+
+def write_config(work: Path, settings: dict[str, object]):
+    (work / "config.py").write_text(
+        "".join(f"{name} = {value!r}\n" for name, value in settings.items())
+    )
+
+
+def post_urls(work: Path) -> list[str]:
+    """Weblog URLs, newest first."""
+    return sorted(
+        (f"/weblog/{post.parent.name}/{post.stem}" for post in (work / "weblog").glob("*/*.md")),
+        reverse=True,
+    )
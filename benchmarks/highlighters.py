@@ -0,0 +1,70 @@
+"""Compares the latency of the highlighting backends.
+
+Run from the repository root:
+
+    python -m benchmarks.highlighters [file ...] [--rounds N]
+
+Every file is highlighted `rounds` times by each backend, after one warm-up
+round. Backends that don't become ready (e.g. node isn't installed) are skipped.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from pathlib import Path
+
+from utils.highlighter import CodeBlock, Highlighter, create_backend
+
+DEFAULT_FILES = ["app.py", "routes/frontend.py", "utils/shiki.js", "static/styles/code.css"]
+
+
+def percentile(samples: list[float], percent: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))]
+
+
+async def measure(backend: Highlighter, blocks: list[CodeBlock], rounds: int) -> list[float]:
+    samples = []
+    await backend.highlight_blocks(blocks, "vitesse-dark")
+    for _ in range(rounds):
+        for block in blocks:
+            started = time.perf_counter()
+            await backend.highlight_blocks([block], "vitesse-dark")
+            samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", default=DEFAULT_FILES)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--backends", nargs="+", default=["shiki", "pygments"])
+    args = parser.parse_args()
+
+    blocks = [CodeBlock(Path(file).read_text(), file.rsplit(".", 1)[-1]) for file in args.files]
+    print(f"{len(blocks)} files, {sum(len(block.code) for block in blocks)} characters.")
+
+    for name in args.backends:
+        backend = create_backend(name)
+        started = time.perf_counter()
+        await backend.start()
+        try:
+            if not await backend.wait_ready(timeout=30):
+                print(f"{name:>10}: not ready, skipped.")
+                continue
+            startup = (time.perf_counter() - started) * 1000
+            samples = await measure(backend, blocks, args.rounds)
+        finally:
+            await backend.stop()
+
+        print(
+            f"{name:>10}: startup {startup:7.1f}ms"
+            f"  p50 {percentile(samples, 50):6.2f}ms"
+            f"  p95 {percentile(samples, 95):6.2f}ms"
+            f"  mean {statistics.fmean(samples):6.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
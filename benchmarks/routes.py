@@ -0,0 +1,356 @@
+"""Measures the app's routes end to end, against fixtures and stubbed services.
+
+Run from the repository root:
+
+    python -m benchmarks.routes [--output results.json] [--compare previous.json]
+
+A copy of the site is built in a work folder (see `benchmarks.fixtures`) and
+served by uvicorn, with the stand-ins from `benchmarks.stubs` in place of shiki,
+the music service on :8716 and Last.fm. Every route gets a warm-up, then
+`--requests` requests, `--concurrency` at a time; throughput and p50/p95/p99
+latencies are reported per route. Then `--sse-clients` clients subscribe to
+/api/lastfm-html, and the time from the poller seeing a new song to every
+client receiving it is measured.
+
+With `--compare`, routes whose p99 or throughput got worse by more than
+`--threshold` percent are flagged, and the exit status is 1.
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import aiohttp
+
+from benchmarks import fixtures
+
+DEFAULT_WORK = Path(tempfile.gettempdir()) / "site-benchmark"
+WARM_UP_REQUESTS = 10
+#  Seconds the gallery listing's ETag must stay the same, i.e. thumbnailing is done.
+SETTLE_TIME = 2
+
+
+def route_urls(work: Path) -> dict[str, str]:
+    return {
+        "home": "/",
+        "weblog": "/weblog",
+        "weblog_post": fixtures.post_urls(work)[0],
+        "weblog_search": "/weblog/search?q=cache+wor",
+        "weblog_feed": "/weblog/feed.atom",
+        "gallery": "/gallery",
+        "gallery_folder": "/gallery/gallery0",
+        "code": "/code/code/routes/frontend.py",
+        "code_big": "/code/code/big.py",
+        "obsession_badge": "/obsession/1/image",
+        "listening_badge": "/listening/1/image",
+    }
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """Percentiles of `samples`, in milliseconds."""
+    if len(samples) < 2:
+        samples = samples * 2 or [0.0, 0.0]
+    percentiles = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50_ms": round(percentiles[49], 3),
+        "p95_ms": round(percentiles[94], 3),
+        "p99_ms": round(percentiles[98], 3),
+        "max_ms": round(max(samples), 3),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def start(command: list[str], cwd: Path, log: Path) -> asyncio.subprocess.Process:
+    with log.open("wb") as output:
+        return await asyncio.create_subprocess_exec(
+            *command, cwd=cwd, stdout=output, stderr=subprocess.STDOUT
+        )
+
+
+async def stop(process: asyncio.subprocess.Process):
+    if process.returncode is None:
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), 10)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+
+async def wait_until_up(
+    session: aiohttp.ClientSession, url: str, process: asyncio.subprocess.Process, timeout: float
+):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.returncode is not None:
+            raise RuntimeError("The app exited while starting up, see app.log in the work folder.")
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} didn't come up in {timeout}s.")
+
+
+async def wait_until_settled(session: aiohttp.ClientSession, url: str, timeout: float):
+    """Waits for the galleries to be indexed and thumbnailed, so that doesn't skew results."""
+    deadline = time.monotonic() + timeout
+    etag, since = None, time.monotonic()
+    while time.monotonic() < deadline:
+        async with session.get(url) as response:
+            await response.read()
+            if response.headers.get("ETag") != etag:
+                etag, since = response.headers.get("ETag"), time.monotonic()
+        if time.monotonic() - since >= SETTLE_TIME:
+            return
+        await asyncio.sleep(0.2)
+    print(f"Background work still going after {timeout}s, measuring anyway.")
+
+
+async def measure_route(
+    session: aiohttp.ClientSession, url: str, requests: int, concurrency: int
+) -> dict[str, float]:
+    samples: list[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def request():
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                if response.status >= 400:
+                    errors += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            errors += 1
+        samples.append((time.perf_counter() - started) * 1000)
+
+    async def client():
+        for _ in remaining:
+            await request()
+
+    for _ in range(WARM_UP_REQUESTS):
+        await request()
+    samples.clear()
+    errors = 0
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        **summarize(samples),
+    }
+
+
+class Subscriber:
+    """One /api/lastfm-html client, remembering when every event arrived."""
+
+    def __init__(self):
+        self.received: list[tuple[float, str]] = []
+        self.connected = asyncio.Event()
+
+    async def run(self, session: aiohttp.ClientSession, url: str):
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=None)) as response:
+            self.connected.set()
+            async for line in response.content:
+                if line.startswith(b"data:"):
+                    self.received.append((time.time(), line[5:].decode().strip()))
+
+    def received_at(self, song: str) -> float | None:
+        return next((at for at, data in self.received if song in data), None)
+
+
+async def measure_fan_out(
+    session: aiohttp.ClientSession, app_url: str, upstream_url: str, clients: int, rounds: int
+) -> dict[str, float]:
+    subscribers = [Subscriber() for _ in range(clients)]
+    tasks = [
+        asyncio.create_task(subscriber.run(session, f"{app_url}/api/lastfm-html"))
+        for subscriber in subscribers
+    ]
+    samples: list[float] = []
+    missed = 0
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(subscriber.connected.wait() for subscriber in subscribers)), 30
+        )
+        for _ in range(rounds):
+            async with session.post(f"{upstream_url}/next") as response:
+                song = (await response.json())["song"]
+            # Polled every couple of seconds while something is playing.
+            deadline = time.monotonic() + 15
+            while time.monotonic() < deadline:
+                if all(subscriber.received_at(song) for subscriber in subscribers):
+                    break
+                await asyncio.sleep(0.05)
+            async with session.get(f"{upstream_url}/served") as response:
+                served_at = (await response.json())["served_at"]
+            for subscriber in subscribers:
+                received_at = subscriber.received_at(song)
+                if received_at is None or served_at is None:
+                    missed += 1
+                else:
+                    samples.append((received_at - served_at) * 1000)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return {"clients": clients, "rounds": rounds, "missed": missed, **summarize(samples)}
+
+
+def compare(results: dict, previous: dict, threshold: float) -> bool:
+    """Prints how every route changed since `previous`, returns whether any got worse."""
+    regressed = False
+    print(f"\nCompared to {previous.get('timestamp')} ({previous.get('commit', '?')[:10]}):")
+    for name, now in results["routes"].items():
+        before = previous.get("routes", {}).get(name)
+        if not before:
+            continue
+        p99 = (now["p99_ms"] / before["p99_ms"] - 1) * 100 if before["p99_ms"] else 0
+        throughput = (
+            (now["throughput_rps"] / before["throughput_rps"] - 1) * 100
+            if before["throughput_rps"]
+            else 0
+        )
+        worse = p99 > threshold or throughput < -threshold
+        regressed |= worse
+        print(f"{name:>16}: p99 {p99:+6.1f}%  throughput {throughput:+6.1f}%{'  <- worse' if worse else ''}")
+    return regressed
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args: argparse.Namespace) -> dict:
+    work: Path = args.work.resolve()
+    print(f"Building fixtures in {work}...")
+    fixtures.build(work, args.posts, args.galleries, args.images, args.big_file_lines)
+    upstream_port, app_port = free_port(), free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    fixtures.write_config(
+        work,
+        {
+            "LASTFM_USERNAME": "benchmark",
+            "LASTFM_API_KEY": "benchmark",
+            "LASTFM_API_URL": f"{upstream_url}/2.0/",
+            "GITHUB_SECRET": "",
+            "FILES_FOLDER": str(work / "files"),
+            "MUSIC_SERVICE_URL": upstream_url,
+            "HIGHLIGHTER": args.highlighter,
+            "HIGHLIGHTER_COMMAND": [
+                sys.executable, "-m", "benchmarks.stubs", "shiki", "--latency", str(args.shiki_latency)
+            ],
+        },
+    )
+
+    upstream = await start(
+        [sys.executable, "-m", "benchmarks.stubs", "upstream", "--port", str(upstream_port),
+         "--latency", str(args.upstream_latency)],
+        work,
+        work / "upstream.log",
+    )
+    app = await start(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(app_port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        work,
+        work / "app.log",
+    )
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=60)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await wait_until_up(session, app_url + "/", app, timeout=90)
+            await wait_until_settled(session, app_url + "/gallery", timeout=300)
+
+            results: dict = {
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "commit": commit(),
+                "settings": {
+                    name: str(value) if isinstance(value, Path) else value
+                    for name, value in vars(args).items()
+                },
+                "routes": {},
+            }
+            for name, url in route_urls(work).items():
+                if args.routes and name not in args.routes:
+                    continue
+                result = await measure_route(session, app_url + url, args.requests, args.concurrency)
+                results["routes"][name] = result
+                print(
+                    f"{name:>16}: {result['throughput_rps']:8.1f} req/s  p50 {result['p50_ms']:7.2f}ms"
+                    f"  p95 {result['p95_ms']:7.2f}ms  p99 {result['p99_ms']:7.2f}ms"
+                    f"  errors {result['errors']}"
+                )
+
+            if args.sse_clients:
+                sse = await measure_fan_out(
+                    session, app_url, upstream_url, args.sse_clients, args.sse_rounds
+                )
+                results["sse_fan_out"] = sse
+                print(
+                    f"{'sse fan-out':>16}: {sse['clients']} clients  p50 {sse['p50_ms']:7.2f}ms"
+                    f"  p95 {sse['p95_ms']:7.2f}ms  p99 {sse['p99_ms']:7.2f}ms  missed {sse['missed']}"
+                )
+            return results
+    finally:
+        await stop(app)
+        await stop(upstream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", type=Path, help="write the results here as JSON")
+    parser.add_argument("--compare", type=Path, help="results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=10, help="percent worse to flag")
+    parser.add_argument("--routes", nargs="+", help="only measure these routes")
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--highlighter", default="shiki", choices=["shiki", "pygments"])
+    parser.add_argument("--shiki-latency", type=float, default=0.005, help="seconds")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--sse-clients", type=int, default=200, help="0 to skip")
+    parser.add_argument("--sse-rounds", type=int, default=5)
+    parser.add_argument("--posts", type=int, default=30)
+    parser.add_argument("--galleries", type=int, default=3)
+    parser.add_argument("--images", type=int, default=24, help="per gallery")
+    parser.add_argument("--big-file-lines", type=int, default=20_000)
+    parser.add_argument("--work", type=Path, default=DEFAULT_WORK)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.output}.")
+    if args.compare and compare(results, json.loads(args.compare.read_text()), args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Local stand-ins for the services the app talks to, with configurable latency.
+
+    python -m benchmarks.stubs shiki SOCKET [--latency SECONDS]
+    python -m benchmarks.stubs upstream --port PORT [--latency SECONDS]
+
+`shiki` speaks the `utils/shiki.js` protocol on a Unix socket, and is what the
+benchmarked app runs as its HIGHLIGHTER_COMMAND. `upstream` is both the music
+service on :8716 and Last.fm's API. POST /next there starts a new song, and
+GET /served says when the poller first saw it, for measuring SSE fan-out.
+"""
+
+import argparse
+import asyncio
+import html
+import time
+
+from aiohttp import web
+
+
+def shiki_app(latency: float) -> web.Application:
+    def render(code: str, lang: str) -> str:
+        lines = "\n".join(
+            f'<span class="line"><span style="color:#dbd7ca">{html.escape(line)}</span></span>'
+            for line in code.split("\n")
+        )
+        return f'<pre class="shiki vitesse-dark" data-lang="{html.escape(lang)}"><code>{lines}</code></pre>'
+
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def highlight_batch(request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(latency)
+        return web.json_response([render(block["code"], block["lang"]) for block in body["blocks"]])
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.add_routes([web.get("/health", health), web.post("/hlbatch", highlight_batch)])
+    return app
+
+
+class Upstream:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.song = 0
+        #  When a poll first returned the current song.
+        self.served_at: float | None = None
+
+    async def music(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        return web.json_response(
+            {"title": "Bohemian Rhapsody", "artist": "Queen", "track_id": "4u7EnebtmKWzUH433cf5Qv"}
+        )
+
+    async def lastfm(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        if self.served_at is None:
+            self.served_at = time.time()
+        track = {
+            "name": f"Benchmark song {self.song}",
+            "url": f"https://www.last.fm/music/Benchmark/_/{self.song}",
+            "artist": {"#text": "Benchmark"},
+            "@attr": {"nowplaying": "true"},
+        }
+        return web.json_response({"recenttracks": {"track": [track]}})
+
+    async def next_song(self, request: web.Request) -> web.Response:
+        self.song += 1
+        self.served_at = None
+        return web.json_response({"song": f"Benchmark song {self.song}"})
+
+    async def served(self, request: web.Request) -> web.Response:
+        return web.json_response({"song": self.song, "served_at": self.served_at})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/obsession/{user_id}", self.music),
+                web.get("/spotify/{user_id}", self.music),
+                web.get("/2.0/", self.lastfm),
+                web.post("/next", self.next_song),
+                web.get("/served", self.served),
+            ]
+        )
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    shiki = commands.add_parser("shiki")
+    shiki.add_argument("--latency", type=float, default=0)
+    shiki.add_argument("socket")
+    upstream = commands.add_parser("upstream")
+    upstream.add_argument("--latency", type=float, default=0)
+    upstream.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+
+    if args.command == "shiki":
+        web.run_app(shiki_app(args.latency), path=args.socket, print=None)
+    else:
+        web.run_app(Upstream(args.latency).app(), host="127.0.0.1", port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
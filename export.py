@@ -0,0 +1,215 @@
+"""Renders every page of the site into a folder that a web server can serve as is.
+
+    python export.py OUTPUT [--workers N] [--full]
+
+Pages are requested from the app in-process, so they come out exactly as they
+would be served. Later runs send the ETag of the last export, and pages whose
+sources didn't change answer 304 without being rendered, and are left alone.
+Pages without validators are rendered again, but only written when their bytes
+changed. Posts are rendered as they are asked for, not all ahead as the app
+does when it starts.
+
+Anything with a query string (htmx pages of galleries and code, search) and the
+dynamic endpoints (SSE, badges, feeds, webhook) still need the app, e.g. with nginx:
+
+    location / {
+        if ($args) { proxy_pass http://app; }
+        try_files $uri $uri/index.html @app;
+    }
+    location /api/ { proxy_pass http://app; }
+    location @app { proxy_pass http://app; }
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+import httpx
+
+from app import app
+from routes import files, frontend
+from utils.static_assets import static_assets
+from utils.thumbnails import IMAGE_SUFFIXES
+from utils.weblog_index import weblog_index
+
+log = logging.getLogger("export")
+
+MANIFEST = ".export.json"
+#  Seconds to wait for the gallery index and thumbnails before exporting without them.
+BACKGROUND_TIMEOUT = 600
+#  Bytes sniffed to tell text files, which get a /code page, from binary ones.
+SNIFF_SIZE = 8192
+
+
+def is_text(file: Path) -> bool:
+    try:
+        with file.open("rb") as handle:
+            chunk = handle.read(SNIFF_SIZE)
+    except OSError:
+        return False
+    if b"\0" in chunk:
+        return False
+    try:
+        chunk.decode("utf-8")
+    except UnicodeDecodeError as error:
+        # A multi-byte character cut off at the end of the chunk is fine.
+        return error.start >= len(chunk) - 3
+    return True
+
+
+def code_urls() -> list[str]:
+    return [
+        "/code/" + quote(file.relative_to(files.BASE_PATH).as_posix())
+        for file in sorted(files.BASE_PATH.rglob("*"))
+        if file.is_file() and file.suffix.lower() not in IMAGE_SUFFIXES and is_text(file)
+    ]
+
+
+def site_urls() -> list[str]:
+    """The navigation pages of the frontend router, then every post, gallery and file."""
+    urls = [route.path for route in frontend.frontpage.routes if not route.path_parameters]
+    for folder in weblog_index.folders:
+        urls.append(f"/weblog/{folder.year}")
+        urls.extend(file.href for file in folder.files)
+    if frontend.GALLERIES_FOLDER.is_dir():
+        urls.extend(
+            f"/gallery/{folder.name}"
+            for folder in sorted(frontend.GALLERIES_FOLDER.iterdir())
+            if folder.is_dir() and folder.name.isalnum()
+        )
+    return urls + code_urls()
+
+
+def output_path(output: Path, url: str) -> Path:
+    # Every page is a folder with an index.html, so the URLs stay the same.
+    return output / unquote(url).strip("/") / "index.html"
+
+
+async def background_ready():
+    """Waits for the galleries to be indexed and thumbnailed, so their pages are complete."""
+    if not frontend.GALLERIES_FOLDER.is_dir():
+        return
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + BACKGROUND_TIMEOUT
+    while not (frontend.gallery_index.ready and frontend.thumbnailer.ready):
+        if loop.time() > deadline:
+            log.warning("Galleries are still being indexed, exporting them as they are.")
+            return
+        await asyncio.sleep(0.1)
+
+
+def write_if_changed(path: Path, content: bytes) -> bool:
+    if path.exists() and path.read_bytes() == content:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f".{path.name}.tmp")
+    temporary.write_bytes(content)
+    os.replace(temporary, path)
+    return True
+
+
+class Exporter:
+    def __init__(self, output: Path, workers: int, full: bool):
+        self.output = output
+        self.workers = workers
+        self.previous: dict[str, dict[str, str]] = {}
+        if not full:
+            try:
+                self.previous = json.loads((output / MANIFEST).read_text())
+            except (OSError, ValueError):
+                pass
+        self.manifest: dict[str, dict[str, str]] = {}
+        self.counts = {"rendered": 0, "unchanged": 0, "skipped": 0}
+
+    async def export_page(self, client: httpx.AsyncClient, url: str):
+        previous = self.previous.get(url, {})
+        headers = {"If-None-Match": previous["etag"]} if "etag" in previous else {}
+        target = output_path(self.output, url)
+
+        response = await client.get(url, headers=headers)
+        if response.status_code == 304 and target.exists():
+            self.manifest[url] = previous
+            self.counts["unchanged"] += 1
+            return
+        if response.status_code == 304:
+            # Someone deleted the file, ask again without the ETag.
+            response = await client.get(url)
+        if response.status_code != 200:
+            log.warning("Skipping %s, it answered %s.", url, response.status_code)
+            self.counts["skipped"] += 1
+            return
+
+        changed = await asyncio.to_thread(write_if_changed, target, response.content)
+        self.manifest[url] = {"sha256": hashlib.sha256(response.content).hexdigest()}
+        if etag := response.headers.get("ETag"):
+            self.manifest[url]["etag"] = etag
+        self.counts["rendered" if changed else "unchanged"] += 1
+
+    def copy_static(self):
+        shutil.copytree(static_assets.destination, self.output / "assets", dirs_exist_ok=True)
+        shutil.copytree(static_assets.source, self.output / "static", dirs_exist_ok=True)
+
+    def remove_stale(self):
+        for url in self.previous.keys() - self.manifest.keys():
+            log.info("Removing %s, it is gone.", url)
+            page = output_path(self.output, url)
+            page.unlink(missing_ok=True)
+            try:
+                page.parent.rmdir()
+            except OSError:
+                pass
+
+    async def run(self):
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.workers)
+        transport = httpx.ASGITransport(app=app)
+        app.state.exporting = True
+
+        # Pages are asked for at the site's own URL, since some of them link to themselves.
+        async with app.lifespan(), httpx.AsyncClient(
+            transport=transport, base_url=frontend.SITE_URL, timeout=120
+        ) as client:
+
+            async def export_one(url: str):
+                async with semaphore:
+                    await self.export_page(client, url)
+
+            await background_ready()
+            urls = await asyncio.to_thread(site_urls)
+            await asyncio.gather(*(export_one(url) for url in urls))
+            await asyncio.to_thread(self.copy_static)
+
+        self.remove_stale()
+        write_if_changed(self.output / MANIFEST, json.dumps(self.manifest, indent=2).encode())
+        log.info(
+            "Exported %s pages in %.2fs: %s.",
+            len(urls),
+            time.perf_counter() - started,
+            ", ".join(f"{count} {name}" for name, count in self.counts.items()),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", type=Path)
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 4, help="pages rendered at once"
+    )
+    parser.add_argument("--full", action="store_true", help="ignore the previous export")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(name)s - %(message)s")
+    # httpx logs every request at INFO, which buries the summary under one line per page.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(Exporter(args.output, args.workers, args.full).run())
+
+
+if __name__ == "__main__":
+    main()
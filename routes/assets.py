@@ -0,0 +1,32 @@
+from litestar import Request, Router, get
+from litestar.exceptions import HTTPException
+from litestar.response import File
+
+from utils.static_assets import media_type, static_assets
+
+#  Built assets are named after their contents, so they never change.
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+@get("{path:path}")
+async def serve_asset(request: Request, path: str) -> File:
+    """Serves fingerprinted files from `static/`, precompressed when the client allows."""
+    path = path.removeprefix("/")
+    resolved = static_assets.resolve(path, request.headers.get("Accept-Encoding", ""))
+    if resolved is None:
+        raise HTTPException(detail="Asset does not exist.", status_code=404)
+
+    file, encoding = resolved
+    headers = {"Cache-Control": IMMUTABLE, "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return File(
+        path=file,
+        filename=path.rpartition("/")[2],
+        media_type=media_type(path),
+        content_disposition_type="inline",
+        headers=headers,
+    )
+
+
+router = Router("/assets", route_handlers=[serve_asset])
@@ -1,40 +1,148 @@
+import asyncio
+import html
 import pathlib
+import re
+from typing import NamedTuple
+
 import aiohttp
 
-from litestar import MediaType, Response, get, Router, Request
+from litestar import MediaType, Response, get, Router
 from litestar.exceptions import HTTPException
+from litestar.plugins.htmx import HTMXRequest, HTMXTemplate
 from litestar.response import Template
-from litestar.controller import Controller
 import os
 
-BASE_PATH = pathlib.Path("/www/files")
+import config
+from utils.conditional import Validator
+from utils.highlight_cache import CacheKey, highlight_cache
+from utils import highlighter
+from utils.highlighter import HighlighterUnavailable, highlight_code
+from utils.line_reader import line_reader
+from utils.timing import phase
+
+BASE_PATH = pathlib.Path(getattr(config, "FILES_FOLDER", "/www/files"))
+CHUNK_LINES = 1000
+MAX_LINES_PER_REQUEST = 5 * CHUNK_LINES
+#  Files bigger than this (in bytes) are shown as plain text instead of highlighted.
+PLAIN_TEXT_LIMIT: int = getattr(config, "CODE_PLAIN_TEXT_LIMIT", 2 * 1024 * 1024)
+
+LINES_RE = re.compile(r"^(?P<start>\d+)-(?P<stop>\d+)$")
+
+
+class Chunk(NamedTuple):
+    html: str
+    start: int
+    stop: int
+    total_lines: int
+    plain: bool
+    #  Plain text only because the highlighter is down.
+    unavailable: bool = False
+
+    @property
+    def next_lines(self) -> str | None:
+        if self.stop < self.total_lines:
+            return f"{self.stop + 1}-{self.stop + CHUNK_LINES}"
+
+
+def parse_lines(lines: str | None) -> tuple[int, int]:
+    """The requested range, widened to whole chunks so that only those are ever cached."""
+    if lines is None:
+        return 1, CHUNK_LINES
+    match = LINES_RE.fullmatch(lines)
+    if not match or not 0 < int(match.group("start")) <= int(match.group("stop")):
+        raise HTTPException(detail="Invalid line range.", status_code=400)
+    start = (int(match.group("start")) - 1) // CHUNK_LINES * CHUNK_LINES + 1
+    stop = -(-int(match.group("stop")) // CHUNK_LINES) * CHUNK_LINES
+    return start, min(stop, start + MAX_LINES_PER_REQUEST - 1)
+
+
+def render_plain(code: str) -> str:
+    lines = "\n".join(f'<span class="line">{html.escape(line)}</span>' for line in code.splitlines())
+    return f'<pre class="plain"><code>{lines}</code></pre>'
+
+
+def numbered(body: str, start: int) -> str:
+    return body.replace("<code>", f'<code style="counter-reset: step {start - 1}">', 1)
+
+
+async def render_chunk(
+    file: pathlib.Path, key: CacheKey, start: int, stop: int, total_lines: int
+) -> Chunk:
+    """Highlights lines `start` to `stop` of `file`, reading only that part of it."""
+    plain = key.size > PLAIN_TEXT_LIMIT
+    body = await highlight_cache.get(key)
+
+    if body is None:
+        try:
+            with phase("fs"):
+                code, _ = await asyncio.to_thread(
+                    line_reader.read, file, (key.path, key.mtime_ns, key.size), start, stop
+                )
+        except (OSError, UnicodeDecodeError):
+            raise HTTPException(detail="Failed displaying file.", status_code=404)
+
+        if plain:
+            body = render_plain(code)
+        else:
+            try:
+                body = await highlight_code(code.removesuffix("\n"), key.lang, key.theme)
+            except (aiohttp.ClientError, HighlighterUnavailable):
+                # Show the text anyway, but don't remember it so it gets highlighted later.
+                body = numbered(render_plain(code), start)
+                return Chunk(body, start, stop, total_lines, plain=True, unavailable=True)
+        await highlight_cache.set(key, body)
+
+    body = numbered(body, start)
+    return Chunk(body, start, stop, total_lines, plain)
 
 
 @get("{filename:path}", media_type=MediaType.HTML)
-async def render_code_block(request: Request, filename: str) -> Template:
-    file = BASE_PATH / filename.removeprefix("/")
+async def render_code_block(
+    request: HTMXRequest, filename: str, lines: str | None = None
+) -> Template | Response:
+    """Shows a file, a chunk at a time. htmx requests only get the next chunk's fragment."""
+    filename = filename.removeprefix("/")
+    file = BASE_PATH / filename
 
     common = pathlib.Path(os.path.commonprefix([BASE_PATH, file.resolve()]))
 
     if common != BASE_PATH or not file.exists() or not file.is_file():
         raise HTTPException(detail="File does not exist.", status_code=404)
+
+    start, stop = parse_lines(lines)
+    key = CacheKey.for_file(
+        file, lang=filename.split(".")[-1], theme="github-dark", engine=highlighter.backend.name
+    )
+
+    # Revalidating costs only the stat above, counting the file's lines can mean reading it all.
+    headers = {"Vary": "HX-Request"}
+    validator = Validator.of(
+        key.mtime_ns, key.size, f"{start}-{stop}", key.engine, bool(request.htmx)
+    )
+    if validator.matches(request):
+        return validator.not_modified(headers)
+
     try:
-        file.read_text()
-    except:
+        with phase("fs"):
+            total_lines = await asyncio.to_thread(
+                line_reader.total_lines, file, (key.path, key.mtime_ns, key.size)
+            )
+    except OSError:
         raise HTTPException(detail="Failed displaying file.", status_code=404)
+    if start > max(total_lines, 1):
+        raise HTTPException(detail="Line range is past the end of the file.", status_code=404)
+    stop = min(stop, total_lines)
+    key = key._replace(lines=f"{start}-{stop}")
+
+    chunk = await render_chunk(file, key, start, stop, total_lines)
+    # Don't pin the plain text shown while the highlighter is down.
+    if not chunk.unavailable:
+        headers.update(validator.headers)
 
-    session: aiohttp.ClientSession = request.app.state.session
-    async with session.get(
-        f"http://127.0.0.1:39389/hl",
-        params={
-            "lang": filename.split(".")[-1],
-            "theme": "github-dark",
-            "path": file.absolute().as_posix(),
-        },
-    ) as resp:
-        html = await resp.text()
-
-    return Template("code.html", context={"filename": filename, "html": html})
+    context = {"filename": filename, "chunk": chunk, "engine": highlighter.backend.name}
+    if request.htmx:
+        return HTMXTemplate(template_name="code_chunk.html", context=context, headers=headers)
+    return Template("code.html", context=context, headers=headers)
 
 
 router = Router("code", route_handlers=[render_code_block])
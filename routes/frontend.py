@@ -1,6 +1,7 @@
 import asyncio
 import os
 import re
+from contextvars import ContextVar
 from datetime import date
 from pathlib import Path
 from typing import Any, Mapping, NamedTuple
@@ -8,19 +9,44 @@ from typing import Any, Mapping, NamedTuple
 import aiohttp
 import mistune
 from jinja2.filters import do_mark_safe
-from litestar import MediaType, Request, Router, get
+from litestar import MediaType, Request, Response, Router, get
 from litestar.exceptions import HTTPException
-from litestar.response import ServerSentEvent, Template, Redirect
-from markupsafe import Markup
+from litestar.plugins.htmx import HTMXRequest, HTMXTemplate
+from litestar.response import ServerSentEvent, ServerSentEventMessage, Template, Redirect
+from markupsafe import Markup, escape
 import random
 from urllib.request import urlopen, Request
 import config
-import requests
+from utils.highlighter import CodeBlock, HighlighterUnavailable, highlight_blocks
+from utils.conditional import Validator
+from utils.gallery_index import GalleryIndex, ImageInfo
+from utils.now_playing import NowPlayingHub, Poll, PollError, RateLimited, parse_retry_after
+from utils.render_cache import RenderCache
+from utils.thumbnails import Thumbnailer, Variants
+from utils.timing import phase
+from utils.weblog_feed import Feed, WeblogFeed
+from utils.weblog_index import FILE_NAME_RE, File, post_title, weblog_index
+from utils.weblog_search import weblog_search
 
 REPL = {"and": "&", "_": " "}
 PATTERN = re.compile("|".join(re.escape(k) for k in REPL), flags=re.IGNORECASE)
 LFM_LOGO = "<img src='/static/graphics/lastfm.svg' style='height:1em; vertical-align:middle; padding-bottom: 0.1em'/>"
-GALLERIES_FOLDER = Path("/www/files/gallery")
+GALLERIES_FOLDER = Path(getattr(config, "FILES_FOLDER", "/www/files")) / "gallery"
+GALLERY_PAGE_SIZE = 24
+THUMBNAILS_FOLDER = GALLERIES_FOLDER.with_name("gallery-thumbnails")
+#  Concurrent /api/lastfm-html streams per worker, later clients get a snapshot instead.
+LASTFM_MAX_STREAMS: int = getattr(config, "LASTFM_MAX_STREAMS", 10_000)
+#  Clients over the limit try again after this many milliseconds.
+LASTFM_RETRY_LATER = 60_000
+#  Clients of a stream that ended reconnect after somewhere in this many milliseconds,
+#  spread out so that a worker shutting down doesn't send everyone to the next at once.
+LASTFM_RECONNECT = (500, 5_000)
+#  The benchmarks point this at a local stand-in.
+LASTFM_API_URL: str = getattr(config, "LASTFM_API_URL", "http://ws.audioscrobbler.com/2.0/")
+#  Where the site is served from, feeds need absolute links.
+SITE_URL: str = getattr(config, "SITE_URL", "https://leo.might-be.gay")
+#  Newest posts in the weblog feeds, with their full content.
+WEBLOG_FEED_ENTRIES: int = getattr(config, "WEBLOG_FEED_ENTRIES", 20)
 
 
 # Homepage
@@ -29,80 +55,69 @@ class LastFmPoller:
     LISTENING_TO = "<p>{LFM_LOGO} Listening to <a href={song_url} target='_blank'><b>{song}</b></a> by {artist}</p>"
     LAST_LISTENED = "<p>{LFM_LOGO} Last listened to <a href={song_url} target='_blank'><b>{song}</b></a> by {artist}</p>"
 
-    def __init__(self):
-        self.waiters: dict[int, asyncio.Event] = {}
-        self.html = self.NOTHING
-        asyncio.create_task(self.lastfm_getter())
-
-    def set_waiters(self):
-        for waiter in self.waiters.values():
-            waiter.set()
+    #  Last.fm's error code for going over the rate limit.
+    RATE_LIMIT_EXCEEDED = 29
 
-    async def update_from_lastfm(self, session: aiohttp.ClientSession | None = None):
-        _session = session or aiohttp.ClientSession()
-        try:
-            params = {
-                "method": "user.getrecenttracks",
-                "user": config.LASTFM_USERNAME,
-                "format": "json",
-                "api_key": config.LASTFM_API_KEY,
-                "limit": 1,
-            }
-            async with _session.get(
-                "http://ws.audioscrobbler.com/2.0/", params=params
+    def __init__(self):
+        self.etag: str | None = None
+        self.playing = False
+
+    async def fetch(self, session: aiohttp.ClientSession) -> Poll:
+        """Asks Last.fm for the latest scrobble."""
+        params = {
+            "method": "user.getrecenttracks",
+            "user": config.LASTFM_USERNAME,
+            "format": "json",
+            "api_key": config.LASTFM_API_KEY,
+            "limit": 1,
+        }
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        with phase("lastfm"):
+            async with session.get(
+                LASTFM_API_URL,
+                params=params,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=10),
             ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    try:
-                        song = data["recenttracks"]["track"][0]
-                        song_name = song["name"]
-                        song_url = song["url"]
-                        song_artist = song["artist"]["#text"]
-
-                        if song.get("@attr", {}).get("nowplaying") == "true":
-                            to_fmt = self.LISTENING_TO
-                        else:
-                            to_fmt = self.LAST_LISTENED
-
-                        new_html = to_fmt.format(
-                            LFM_LOGO=LFM_LOGO,
-                            song_url=song_url,
-                            song=song_name,
-                            artist=song_artist,
-                        )
-                        if self.html != new_html:
-                            self.html = new_html
-                            self.set_waiters()
-
-                    except (KeyError, AssertionError):
-                        if self.html != self.NOTHING:
-                            self.html = self.NOTHING
-                            self.set_waiters()
-        finally:
-            if not session:
-                await _session.close()
-
-    async def lastfm_getter(self):
-        async with aiohttp.ClientSession() as session:
-            while True:
-                if self.waiters:
-                    await self.update_from_lastfm(session)
-                await asyncio.sleep(2)
-
-    async def iterator(self):
-        yield self.html
-        waiter = asyncio.Event()
-        self.waiters[id(waiter)] = waiter
+                if response.status == 304:
+                    return Poll(None, self.playing)
+                if response.status == 429:
+                    raise RateLimited(parse_retry_after(response.headers.get("Retry-After")))
+                response.raise_for_status()
+                data = await response.json()
+                self.etag = response.headers.get("ETag")
+
+        if "error" in data:
+            self.etag = None
+            if data["error"] == self.RATE_LIMIT_EXCEEDED:
+                raise RateLimited()
+            raise PollError(f"Last.fm error {data['error']}: {data.get('message')}")
+
         try:
-            while True:
-                await waiter.wait()
-                yield self.html
-                waiter.clear()
-        finally:
-            self.waiters.pop(id(waiter))
+            song = data["recenttracks"]["track"][0]
+            song_name = song["name"]
+            song_url = song["url"]
+            song_artist = song["artist"]["#text"]
+        except (KeyError, IndexError):
+            self.playing = False
+            return Poll(self.NOTHING, False)
+
+        self.playing = song.get("@attr", {}).get("nowplaying") == "true"
+        to_fmt = self.LISTENING_TO if self.playing else self.LAST_LISTENED
+        html = to_fmt.format(
+            LFM_LOGO=LFM_LOGO,
+            song_url=song_url,
+            song=song_name,
+            artist=song_artist,
+        )
+        return Poll(html, self.playing)
 
 
 lastfm_poller = LastFmPoller()
+#  Started in the app's lifespan, shared by every worker process.
+now_playing = NowPlayingHub(
+    lastfm_poller.fetch, LastFmPoller.NOTHING, max_subscribers=LASTFM_MAX_STREAMS
+)
 
 
 def age():
@@ -110,17 +125,25 @@ def age():
     return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
 
 
+async def lastfm_events():
+    async for html in now_playing.stream():
+        # Heartbeats are comments, which the browser ignores, but they make the
+        # server notice connections that are gone.
+        yield html if html is not None else ServerSentEventMessage(data=None, comment="")
+    # The stream expired or this worker is stopping, the browser reconnects on its own.
+    yield ServerSentEventMessage(data=None, retry=random.randint(*LASTFM_RECONNECT))
+
+
 @get("/lastfm-html")
 async def serve_lastfm_htmx() -> ServerSentEvent:
     """Updates the real-time music text."""
-    if config.LASTFM_API_KEY:
-        if not lastfm_poller.waiters:
-            asyncio.create_task(lastfm_poller.update_from_lastfm())
+    if not config.LASTFM_API_KEY:
+        return ServerSentEvent(lastfm_poller.NOTHING, event_type="lastfm-html")
+    if now_playing.full():
         return ServerSentEvent(
-            content=lastfm_poller.iterator(), event_type="lastfm-html"
+            now_playing.html, event_type="lastfm-html", retry_duration=LASTFM_RETRY_LATER
         )
-    else:
-        return ServerSentEvent(lastfm_poller.NOTHING, event_type="lastfm-html")
+    return ServerSentEvent(content=lastfm_events(), event_type="lastfm-html")
 
 
 @get("/", media_type=MediaType.HTML)
@@ -137,6 +160,11 @@ async def projects() -> Template:
 class Image(NamedTuple):
     absolute_url: str
     filename: str
+    variants: Variants | None = None
+    width: int | None = None
+    height: int | None = None
+    placeholder: str | None = None
+    taken_at: str | None = None
 
 
 class GalleryFolder(NamedTuple):
@@ -145,15 +173,17 @@ class GalleryFolder(NamedTuple):
     thumbnail: Image | None = None
 
 
+PENDING_BLOCKS: ContextVar[list[CodeBlock]] = ContextVar("PENDING_BLOCKS")
+PLACEHOLDER_RE = re.compile(r"\x00code-block-(\d+)\x00")
+
+
 class CodeBlockRenderer(mistune.HTMLRenderer):
+    """Leaves a placeholder for every fenced block, so they can all be highlighted in one batch."""
+
     def block_code(self, code: str, info: str | None = None) -> str:
-        url = f"http://127.0.0.1:39389/hltext"
-        with requests.post(
-            url,
-            json=dict(code=code.rstrip(), lang=info or "txt"),
-            headers={"Content-Type": "application/json"},
-        ) as req:
-            return do_mark_safe(req.text)
+        blocks = PENDING_BLOCKS.get()
+        blocks.append(CodeBlock(code=code.rstrip(), lang=info or "txt"))
+        return f"\x00code-block-{len(blocks) - 1}\x00"
 
 
 markdown_renderer = mistune.create_markdown(
@@ -163,148 +193,277 @@ markdown_renderer = mistune.create_markdown(
 )
 
 
-def render_markdown(markdown: str):
-    return do_mark_safe(str(markdown_renderer(markdown)))
+def parse_markdown(markdown: str) -> tuple[str, list[CodeBlock]]:
+    token = PENDING_BLOCKS.set([])
+    try:
+        with phase("markdown"):
+            return str(markdown_renderer(markdown)), PENDING_BLOCKS.get()
+    finally:
+        PENDING_BLOCKS.reset(token)
+
+
+async def render_markdown(markdown: str, highlight: bool = True):
+    html, blocks = await asyncio.to_thread(parse_markdown, markdown)
+    if blocks:
+        if highlight:
+            highlighted = await highlight_blocks(blocks)
+        else:
+            highlighted = [f"<pre><code>{escape(block.code)}</code></pre>" for block in blocks]
+        html = PLACEHOLDER_RE.sub(lambda m: highlighted[int(m.group(1))], html)
+    return do_mark_safe(html)
+
+
+def markdown_sources():
+    yield from weblog_index.paths()
+    yield from GALLERIES_FOLDER.glob("*/README.md")
+
 
+markdown_cache = RenderCache(render_markdown, markdown_sources)
 
-def make_readme(folder: Path):
+
+async def load_markdown(file: Path):
+    try:
+        return await markdown_cache.load(file)
+    except (aiohttp.ClientError, HighlighterUnavailable):
+        # Serve it without highlighting for now, the background refresh will retry.
+        return await render_markdown(await asyncio.to_thread(file.read_text), highlight=False)
+
+
+async def make_readme(folder: Path):
     file = folder / "README.md"
+    if (html := markdown_cache.get(file)) is not None:
+        return html
     if not file.exists() or not file.is_file():
         return do_mark_safe("")
-    return render_markdown(file.read_text())
+    return await load_markdown(file)
 
 
-def get_images_from_folder(folder: Path, sort: bool = True):
-    images = (
-        sorted(folder.iterdir(), key=lambda i: i.name, reverse=True)
-        if sort
-        else folder.iterdir()
+thumbnailer = Thumbnailer(
+    GALLERIES_FOLDER, THUMBNAILS_FOLDER, url_prefix=f"/{THUMBNAILS_FOLDER.name}"
+)
+gallery_index = GalleryIndex(GALLERIES_FOLDER)
+
+
+def image_from_info(info: ImageInfo) -> Image:
+    return Image(
+        filename=info.name,
+        absolute_url=f"/gallery/{info.folder}/{info.name}",
+        variants=thumbnailer.get(info.folder, info.name),
+        width=info.width,
+        height=info.height,
+        placeholder=info.placeholder,
+        taken_at=info.taken_at,
     )
 
-    return [
+
+def get_images_from_folder(
+    folder: Path, after: str | None = None, limit: int | None = None
+) -> list[Image]:
+    if gallery_index.ready:
+        infos = gallery_index.images(folder.name, after=after, limit=limit or -1)
+        return [image_from_info(info) for info in infos]
+
+    # The index is still being built, fall back to reading the folder.
+    images = [
         Image(
             filename=image.name,
             absolute_url=f"/gallery/{folder.name}/{image.name}",
+            variants=thumbnailer.get(folder.name, image.name),
         )
-        for image in images
-        if image.is_file() and image.name != "README.md"
+        for image in sorted(folder.iterdir(), key=lambda i: i.name, reverse=True)
+        if image.is_file()
+        and image.name != "README.md"
+        and (after is None or image.name < after)
     ]
+    return images[:limit]
 
 
 @get("/gallery/{folder_name:str}")
-async def get_folder(folder_name: str) -> Template:
+async def get_folder(
+    request: HTMXRequest, folder_name: str, after: str | None = None
+) -> Template | Response:
+    """A page of images from the folder; htmx requests only get the next page's fragment."""
     folder = GALLERIES_FOLDER / folder_name
-    if not (folder_name.isalnum() and folder.exists() and folder.is_dir()):
+    if gallery_index.ready:
+        exists = gallery_index.has_folder(folder_name)
+    else:
+        exists = folder.exists() and folder.is_dir()
+    if not (folder_name.isalnum() and exists):
         raise HTTPException(status_code=404)
 
+    headers = {"Vary": "HX-Request"}
+    with phase("fs"):
+        validator = gallery_validator(folder, after, bool(request.htmx))
+    if validator.matches(request):
+        return validator.not_modified(headers)
+    headers.update(validator.headers)
+
+    with phase("fs"):
+        images = get_images_from_folder(folder, after=after, limit=GALLERY_PAGE_SIZE + 1)
+    next_cursor = None
+    if len(images) > GALLERY_PAGE_SIZE:
+        images = images[:GALLERY_PAGE_SIZE]
+        next_cursor = images[-1].filename
+
+    if request.htmx:
+        return HTMXTemplate(
+            template_name="gallery_page.html",
+            context=dict(
+                images=images,
+                next_cursor=next_cursor,
+                folder=GalleryFolder(name=folder_name, readme_html=Markup()),
+            ),
+            headers=headers,
+        )
+
     return Template(
         "gallery.html",
         context=dict(
-            images=get_images_from_folder(folder),
+            images=images,
+            next_cursor=next_cursor,
             folder=GalleryFolder(
                 name=folder_name,
-                readme_html=make_readme(folder),
+                readme_html=await make_readme(folder),
             ),
         ),
+        headers=headers,
     )
 
 
-@get("/gallery", sync_to_thread=True)
-def gallery(request: Request) -> Template:
-    folders = [
-        GalleryFolder(
-            name=folder.name,
-            readme_html=make_readme(folder),
-            thumbnail=random.choice(get_images_from_folder(folder)),
-        )
+def stat_mtime(path: Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return 0
+
+
+def readme_mtime(folder: Path) -> int:
+    # What the cache holds is what gets served, even if the file changed since.
+    readme = folder / "README.md"
+    entry = markdown_cache.entry(readme)
+    return entry.mtime_ns if entry else stat_mtime(readme)
+
+
+def gallery_validator(folder: Path | None = None, *parts: object) -> Validator:
+    """Validator for the listing of every gallery, or for one `folder`."""
+    if gallery_index.ready:
+        mtimes = gallery_index.mtimes(folder.name if folder else None)
+    else:
+        folders = [folder] if folder else [f for f in GALLERIES_FOLDER.iterdir() if f.is_dir()]
+        mtimes = {f.name: stat_mtime(f) for f in folders}
+    folders = [folder] if folder else [GALLERIES_FOLDER / name for name in mtimes]
+    readmes = [readme_mtime(f) for f in folders]
+    return Validator.of(
+        max([*mtimes.values(), *readmes, 0]),
+        sorted(mtimes.items()),
+        readmes,
+        gallery_index.ready,
+        thumbnailer.count(folder.name if folder else None),
+        *parts,
+    )
+
+
+def list_gallery_folders() -> list[tuple[Path, Image | None]]:
+    if gallery_index.ready:
+        thumbnails = gallery_index.random_images()
+        return [
+            (GALLERIES_FOLDER / name, (info := thumbnails.get(name)) and image_from_info(info))
+            for name in gallery_index.folders()
+        ]
+
+    return [
+        (folder, random.choice(get_images_from_folder(folder) or [None]))
         for folder in sorted(GALLERIES_FOLDER.iterdir(), key=lambda i: i.name)
         if folder.is_dir()
     ]
-    return Template("galleries_index.html", context=dict(folders=folders))
+
+
+@get("/gallery")
+async def gallery(request: Request) -> Template | Response:
+    with phase("fs"):
+        validator = await asyncio.to_thread(gallery_validator)
+    if validator.matches(request):
+        return validator.not_modified()
+
+    if gallery_index.ready:
+        listing = list_gallery_folders()
+    else:
+        with phase("fs"):
+            listing = await asyncio.to_thread(list_gallery_folders)
+    readmes = await asyncio.gather(
+        *(make_readme(folder) for folder, _ in listing)
+    )
+    folders = [
+        GalleryFolder(name=folder.name, readme_html=readme_html, thumbnail=thumbnail)
+        for (folder, thumbnail), readme_html in zip(listing, readmes)
+    ]
+    return Template(
+        "galleries_index.html", context=dict(folders=folders), headers=validator.headers
+    )
 
 
 # Weblog
 
-WEBLOG_YEARS_DIR = Path("./weblog")
-FILE_NAME_RE = re.compile(
-    r"^(?P<month>\d{2})-(?P<day>\d{2})(?:-(?P<title>[\w\-]+))?(:?\.md)?$"
-)
 
+@get("/weblog", media_type=MediaType.HTML)
+async def weblog(request: Request) -> Template | Response:
+    validator = Validator.of(weblog_index.mtime_ns)
+    if validator.matches(request):
+        return validator.not_modified()
+    return Template(
+        "weblog_index.html",
+        context=dict(folders=weblog_index.folders),
+        headers=validator.headers,
+    )
 
-class File(NamedTuple):
-    date: str
-    month: str
-    day: str
-    href: str
-    title: str
 
+weblog_feed = WeblogFeed(weblog_index, markdown_cache, SITE_URL, WEBLOG_FEED_ENTRIES)
+
+
+def feed_response(request: Request, feed: Feed) -> Response:
+    if feed.validator.matches(request):
+        return feed.validator.not_modified()
+    return Response(feed.body, media_type=feed.media_type, headers=feed.validator.headers)
 
-class WeblogFolder(NamedTuple):
-    year: str
-    files: list[File]
-
-
-def get_files_from(folder: Path):
-    files: list[File] = []
-    for file in sorted(folder.iterdir(), key=lambda f: f.name, reverse=True):
-        if not file.is_file():
-            continue
-        match = FILE_NAME_RE.fullmatch(file.name)
-        if not match:
-            continue
-        year = folder.name
-        month = match.group("month")
-        day = match.group("day")
-        title = match.group("title")
-        files.append(
-            File(
-                date=f"{year}-{month}-{day}",
-                title=title.replace("-", " ").title(),
-                day=day,
-                month=month,
-                href=f"/weblog/{year}/{month}-{day}-{title}",
-            )
-        )
-    return files
 
+@get("/weblog/feed.atom")
+async def weblog_atom(request: Request) -> Response:
+    return feed_response(request, await weblog_feed.get("atom"))
 
-@get("/weblog", media_type=MediaType.HTML, sync_to_thread=True)
-def weblog() -> Template:
-    # Scheme: `/Year/Month-Day-title-of-the-log.md`
-    folders: list[WeblogFolder] = []
-    for folder in sorted(
-        WEBLOG_YEARS_DIR.iterdir(), key=lambda dir: dir.name, reverse=True
-    ):
-        if not folder.is_dir() or not (
-            folder.name.isnumeric() and len(folder.name) == 4
-        ):
-            continue
 
-        files: list[File] = get_files_from(folder)
-        if files:
-            folders.append(WeblogFolder(year=folder.name, files=files))
+@get("/weblog/feed.json")
+async def weblog_json(request: Request) -> Response:
+    return feed_response(request, await weblog_feed.get("json"))
 
-    print(folders)
-    return Template("weblog_index.html", context=dict(folders=folders))
+
+@get("/weblog/search")
+async def search_weblog(request: HTMXRequest, q: str = "") -> Template:
+    """Posts matching `q`, best first; htmx requests only get the results' fragment."""
+    query = q.strip()[:200]
+    context = dict(query=query, results=weblog_search.search(query))
+    headers = {"Vary": "HX-Request"}
+    if request.htmx:
+        return HTMXTemplate(
+            template_name="weblog_search_results.html", context=context, headers=headers
+        )
+    return Template("weblog_search.html", context=context, headers=headers)
 
 
 @get("/weblog/{location:path}")
-async def single_weblog(request: Request, location: str) -> Template | Redirect:
+async def single_weblog(request: Request, location: str) -> Template | Redirect | Response:
     year, sep, file = location.removeprefix("/").partition("/")
 
-    if not year.isdigit() or len(year) != 4:
-        raise HTTPException(status_code=404)
-
-    folder = WEBLOG_YEARS_DIR / year
-    if not folder.exists() or not folder.is_dir():
+    if not year.isdigit() or len(year) != 4 or year not in weblog_index.years:
         raise HTTPException(status_code=404)
 
     if not sep:
+        validator = Validator.of(weblog_index.mtime_ns, year)
+        if validator.matches(request):
+            return validator.not_modified()
         return Template(
             "weblog_index.html",
-            context=dict(
-                folders=[WeblogFolder(year=year, files=get_files_from(folder))]
-            ),
+            context=dict(folders=[weblog_index.years[year]]),
+            headers=validator.headers,
         )
 
     match = FILE_NAME_RE.fullmatch(file)
@@ -314,30 +473,41 @@ async def single_weblog(request: Request, location: str) -> Template | Redirect:
     month = match.group("month")
     day = match.group("day")
 
-    file = folder / (file + ".md")
-    if not file.exists():
-        file = next(
-            filter(
-                lambda file: file.name.startswith(f"{month}-{day}"), folder.iterdir()
-            ),
-            None,
-        )
-        if not file:
+    path = weblog_index.post(year, file)
+    if not path:
+        slug = weblog_index.canonical_slug(year, month, day)
+        if not slug:
             raise HTTPException(status_code=404)
-        return Redirect(f"/weblog/{year}/{file.name.removesuffix('.md')}")
+        return Redirect(f"/weblog/{year}/{slug}")
+
+    if (entry := markdown_cache.entry(path)) is not None:
+        validator = Validator.of(entry.mtime_ns, request.url)
+        if validator.matches(request):
+            return validator.not_modified()
+        content = entry.html
+    else:
+        # Whoever has this ETag got a highlighted render of the file as it is, no need for another.
+        validator = Validator.of(await asyncio.to_thread(stat_mtime, path), request.url)
+        if validator.matches(request):
+            return validator.not_modified()
+        content = await load_markdown(path)
+        # Only cached renders get validators, so a fallback without highlighting doesn't stick.
+        entry = markdown_cache.entry(path)
+        validator = entry and Validator.of(entry.mtime_ns, request.url)
 
     return Template(
         "weblog.html",
         context={
-            "content": render_markdown(file.read_text()),
+            "content": content,
             "file": File(
                 date=f"{year}-{month}-{day}",
                 month=month,
                 day=day,
                 href=str(request.url),  # type: ignore - you do exist don't lie to yourself.
-                title=match.group("title").replace("-", " ").title(),
+                title=post_title(match.group("title"), f"{year}-{month}-{day}"),
             ),
         },
+        headers=validator.headers if validator else None,
     )
 
 
@@ -349,21 +519,35 @@ class NavElement(NamedTuple):
 
 def navbar(ctx: Mapping[str, Any]) -> list[NavElement]:
     request: Request = ctx["request"]
-    return [
-        NavElement(
-            title=PATTERN.sub(
-                lambda m: REPL.get(m.group(0).lower(), m.group(0)),
-                route.handler_names[0],
-            ).title(),
-            href=route.path,
-            current=request.url.path == route.path,  # type: ignore
-        )
-        for route in frontpage.routes
-    ]
+    return NAVBARS.get(request.url.path, NAVBARS[None])
 
 
 frontpage = Router("/", route_handlers=[home, projects, weblog, gallery])
+NAV_ENTRIES = [
+    (
+        PATTERN.sub(
+            lambda m: REPL.get(m.group(0).lower(), m.group(0)),
+            route.handler_names[0],
+        ).title(),
+        route.path,
+    )
+    for route in frontpage.routes
+]
+#  The navbar of every page, by the href it marks as current. None marks none of them.
+NAVBARS: dict[str | None, list[NavElement]] = {
+    current: [NavElement(title, href, href == current) for title, href in NAV_ENTRIES]
+    for current in [None, *(href for _, href in NAV_ENTRIES)]
+}
 backend_hooks = Router("/api", route_handlers=[serve_lastfm_htmx])
 router = Router(
-    "/", route_handlers=[frontpage, backend_hooks, single_weblog, get_folder]
+    "/",
+    route_handlers=[
+        frontpage,
+        backend_hooks,
+        weblog_atom,
+        weblog_json,
+        search_weblog,
+        single_weblog,
+        get_folder,
+    ],
 )
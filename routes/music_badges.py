@@ -1,44 +1,75 @@
-import urllib.parse
-
 from litestar import Litestar, MediaType, Request, Response, get, Router
 from litestar.response import Redirect
 
+import config
+from utils.badges import Badge, render_badge
+from utils.conditional import parse_etags
+from utils.timing import phase
+from utils.ttl_cache import TTLCache
+
 OPEN_URL = "https://open.spotify.com/track/{0}"
 LASTFM_API_URL = "http://ws.audioscrobbler.com/2.0/"
+MUSIC_SERVICE_URL: str = getattr(config, "MUSIC_SERVICE_URL", "http://localhost:8716")
+#  Seconds clients (and GitHub's image proxy) may reuse a badge.
+OBSESSION_MAX_AGE = 60
+LISTENING_MAX_AGE = 15
+#  Seconds to trust a 404 from the music service, so that people who just set
+#  something up don't wait long.
+NOT_FOUND_TTL = 10
+
+MusicResponse = tuple[int, dict]
+
+
+def ttl_for(ttl: float):
+    """Caches successes for `ttl` seconds, 404s for `NOT_FOUND_TTL` and nothing else."""
 
+    def for_response(response: MusicResponse) -> float:
+        status, _ = response
+        return ttl if status == 200 else NOT_FOUND_TTL if status == 404 else 0
 
-async def request_obsession(app: Litestar, user_id: int):
-    async with app.state.session.get(
-        f"http://localhost:8716/obsession/{user_id}"
-    ) as resp:
-        return resp.status, await resp.json()
+    return for_response
 
 
-async def request_playing(app: Litestar, user_id: int):
-    async with app.state.session.get(
-        f"http://localhost:8716/spotify/{user_id}"
-    ) as resp:
-        return resp.status, await resp.json()
+obsession_cache: TTLCache[int, MusicResponse] = TTLCache(ttl_for(OBSESSION_MAX_AGE))
+playing_cache: TTLCache[int, MusicResponse] = TTLCache(ttl_for(LISTENING_MAX_AGE))
 
 
-def badge_quote(string: str) -> str:
-    return urllib.parse.quote(string).replace("-", "--").replace("_", "__")
+async def request_music_service(app: Litestar, path: str) -> MusicResponse:
+    with phase("music"):
+        async with app.state.session.get(MUSIC_SERVICE_URL + path) as resp:
+            return resp.status, await resp.json()
+
+
+async def request_obsession(app: Litestar, user_id: int) -> MusicResponse:
+    return await obsession_cache.get(
+        user_id, lambda: request_music_service(app, f"/obsession/{user_id}")
+    )
+
+
+async def request_playing(app: Litestar, user_id: int) -> MusicResponse:
+    return await playing_cache.get(
+        user_id, lambda: request_music_service(app, f"/spotify/{user_id}")
+    )
+
+
+def badge_response(request: Request, badge: Badge, max_age: int) -> Response:
+    headers = {"ETag": badge.etag, "Cache-Control": f"max-age={max_age}, must-revalidate"}
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    if "*" in etags or badge.etag in etags:
+        return Response(b"", status_code=304, headers=headers)
+    return Response(badge.svg, media_type="image/svg+xml", headers=headers)
 
 
 @get("/obsession/{user_id:int}/image")
-async def last_fm_favourite(request: Request, user_id: int) -> Redirect:
+async def last_fm_favourite(request: Request, user_id: int) -> Response:
     status, obsession = await request_obsession(request.app, user_id)
 
     if status == 404:
-        return Redirect(
-            "https://img.shields.io/badge/No obsession set.-252525?style=flat&logo=spotify"
-        )
+        return badge_response(request, render_badge("No obsession set."), OBSESSION_MAX_AGE)
     track_name = obsession["title"]
     artist = obsession["artist"]
-    request.url
-    return Redirect(
-        f"https://img.shields.io/badge/Current_Favourite: {badge_quote(track_name)} by {badge_quote(artist)}-252525?style=flat&logo=spotify"
-    )
+    badge = render_badge(f"Current Favourite: {track_name} by {artist}")
+    return badge_response(request, badge, OBSESSION_MAX_AGE)
 
 
 @get("/obsession/{user_id:int}/redirect")
@@ -53,18 +84,16 @@ async def redirect_to_song(request: Request, user_id: int) -> Response:
 
 
 @get("/listening/{user_id:int}/image")
-async def currently_playing(request: Request, user_id: int) -> Redirect:
+async def currently_playing(request: Request, user_id: int) -> Response:
     status, obsession = await request_playing(request.app, user_id)
 
     if status == 404:
-        return Redirect(
-            "https://img.shields.io/badge/Not listening to anything-252525?style=flat&logo=spotify"
-        )
+        badge = render_badge("Not listening to anything")
+        return badge_response(request, badge, LISTENING_MAX_AGE)
     track_name = obsession["title"]
     artist = obsession["artist"]
-    return Redirect(
-        f"https://img.shields.io/badge/Listening to {badge_quote(track_name)} by {badge_quote(artist)}-252525?style=flat&logo=spotify"
-    )
+    badge = render_badge(f"Listening to {track_name} by {artist}")
+    return badge_response(request, badge, LISTENING_MAX_AGE)
 
 
 @get("/listening/{user_id:int}/redirect")
@@ -1,13 +1,39 @@
+import asyncio
 import hashlib
 import hmac
-import os
 
-from litestar import Request, Router, post
+from litestar import Request, Response, Router, get, post
 from litestar.exceptions import HTTPException
 
 import config
+from routes import frontend, music_badges
+from utils.deploy import deployer
+from utils.highlight_cache import highlight_cache
+from utils.timing import metrics
+from utils.warmup import warmup
+from utils.weblog_search import weblog_search
 
-route_handlers = []
+metrics.register("now_playing", frontend.now_playing.stats)
+metrics.register("obsession_cache", music_badges.obsession_cache.stats)
+metrics.register("playing_cache", music_badges.playing_cache.stats)
+metrics.register("highlight_cache", highlight_cache.stats)
+metrics.register("weblog_search", weblog_search.stats)
+
+
+@get("/metrics", media_type="text/plain; version=0.0.4")
+async def prometheus_metrics() -> str:
+    """Phase and request histograms plus cache stats of every worker, for Prometheus."""
+    return await asyncio.to_thread(metrics.render)
+
+
+@get("/ready")
+async def readiness() -> Response[dict]:
+    """Status of every warmed up component, 503 unless all of them are ready."""
+    report = warmup.report()
+    return Response(report, status_code=200 if report["ready"] else 503)
+
+
+route_handlers = [prometheus_metrics, readiness]
 if config.GITHUB_SECRET:
 
     async def verify_signature(request: Request):
@@ -21,15 +47,16 @@ if config.GITHUB_SECRET:
         )
         return hmac.compare_digest(signature, request.headers["X-Hub-Signature-256"])
 
-    @post("/reboot", status_code=200, no_auth=True)
+    @post("/reboot", status_code=202, no_auth=True)
     async def github_webhook(request: Request) -> dict[str, str]:
-        """The GitHub webhook URL. Runs every time a push is made to the repo."""
+        """The GitHub webhook URL. Runs every time a push is made to the repo.
+
+        Pulls and reloads in the background, see `utils.deploy`.
+        """
         if not await verify_signature(request):
             raise HTTPException(status_code=401, detail="Invalid secret.")
-        os.system(
-            f"cd {os.getcwd()!r} && git pull && sudo systemctl restart might-be-gay.service"
-        )
-        return {"status": "ok"}
+        deployer.start()
+        return {"status": "deploying"}
 
     route_handlers.append(github_webhook)
 
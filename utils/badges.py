@@ -0,0 +1,96 @@
+import hashlib
+import unicodedata
+from functools import lru_cache
+from html import escape
+from typing import NamedTuple
+
+#  Advance widths of Verdana at 11px, the font shields.io badges are measured in.
+VERDANA_11: dict[str, float] = {
+    " ": 3.87, "!": 4.33, '"': 5.05, "#": 9.0, "$": 7.0, "%": 11.84, "&": 7.99, "'": 2.96,
+    "(": 4.99, ")": 4.99, "*": 7.0, "+": 9.0, ",": 4.0, "-": 4.99, ".": 4.0, "/": 4.99,
+    "0": 7.0, "1": 7.0, "2": 7.0, "3": 7.0, "4": 7.0, "5": 7.0, "6": 7.0, "7": 7.0,
+    "8": 7.0, "9": 7.0, ":": 4.99, ";": 4.99, "<": 9.0, "=": 9.0, ">": 9.0, "?": 6.0,
+    "@": 11.0, "A": 7.52, "B": 7.54, "C": 7.68, "D": 8.48, "E": 6.96, "F": 6.32,
+    "G": 8.53, "H": 8.27, "I": 4.63, "J": 5.0, "K": 7.62, "L": 6.12, "M": 9.27,
+    "N": 8.23, "O": 8.66, "P": 6.63, "Q": 8.66, "R": 7.64, "S": 7.52, "T": 6.78,
+    "U": 8.05, "V": 7.52, "W": 10.88, "X": 7.54, "Y": 6.77, "Z": 7.54, "[": 4.99,
+    "\\": 4.99, "]": 4.99, "^": 9.0, "_": 7.0, "`": 7.0, "a": 6.61, "b": 6.7, "c": 5.73,
+    "d": 6.7, "e": 6.55, "f": 3.87, "g": 6.7, "h": 6.94, "i": 3.02, "j": 3.79, "k": 6.51,
+    "l": 3.02, "m": 10.69, "n": 6.94, "o": 6.67, "p": 6.7, "q": 6.7, "r": 4.69, "s": 5.73,
+    "t": 4.33, "u": 6.94, "v": 6.51, "w": 9.0, "x": 6.51, "y": 6.51, "z": 5.78, "{": 6.98,
+    "|": 4.99, "}": 6.98, "~": 9.0,
+}
+#  Anything else is guessed: a full em for wide (CJK) characters, an average letter otherwise.
+WIDE_WIDTH = 11.0
+FALLBACK_WIDTH = 7.0
+
+LOGO_X, LOGO_SIZE, GAP, PADDING = 5, 14, 4, 6
+
+SPOTIFY_LOGO = (
+    "M12 0C5.4 0 0 5.4 0 12s5.4 12 12 12 12-5.4 12-12S18.66 0 12 0zm5.521 17.34c-.24.359-.66.48"
+    "-1.021.24-2.82-1.74-6.36-2.101-10.561-1.141-.418.122-.779-.179-.899-.539-.12-.421.18-.78.54-.9"
+    " 4.56-1.021 8.52-.6 11.64 1.32.42.18.479.659.301 1.02zm1.44-3.3c-.301.42-.841.6-1.262.3-3.239"
+    "-1.98-8.159-2.58-11.939-1.38-.479.12-1.02-.12-1.14-.6-.12-.48.12-1.021.6-1.141C9.6 9.9 15 10.561"
+    " 18.72 12.84c.361.181.54.78.241 1.2zm.12-3.36C15.24 8.4 8.82 8.16 5.16 9.301c-.6.179-1.2-.181"
+    "-1.38-.721-.18-.601.18-1.2.72-1.381 4.26-1.26 11.28-1.02 15.721 1.621.539.3.719 1.02.419 1.56"
+    "-.299.421-1.02.599-1.559.3z"
+)
+
+#  The "flat" shields.io style. Text is drawn at 10x and scaled down, like shields does,
+#  and `textLength` keeps it within the measured width whatever font the viewer has.
+TEMPLATE = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="20" role="img" aria-label="{text}">'
+    "<title>{text}</title>"
+    '<linearGradient id="s" x2="0" y2="100%"><stop offset="0" stop-color="#bbb" stop-opacity=".1"/>'
+    '<stop offset="1" stop-opacity=".1"/></linearGradient>'
+    '<clipPath id="r"><rect width="{width}" height="20" rx="3" fill="#fff"/></clipPath>'
+    '<g clip-path="url(#r)"><rect width="{width}" height="20" fill="#{color}"/>'
+    '<rect width="{width}" height="20" fill="url(#s)"/></g>'
+    '<svg x="{logo_x}" y="3" width="{logo_size}" height="{logo_size}" viewBox="0 0 24 24">'
+    '<path fill="whitesmoke" d="{logo}"/></svg>'
+    '<g fill="#fff" text-anchor="middle" font-family="Verdana,Geneva,DejaVu Sans,sans-serif"'
+    ' text-rendering="geometricPrecision" font-size="110">'
+    '<text aria-hidden="true" x="{text_x}" y="150" fill="#010101" fill-opacity=".3"'
+    ' transform="scale(.1)" textLength="{text_length}">{text}</text>'
+    '<text x="{text_x}" y="140" transform="scale(.1)" fill="#fff" textLength="{text_length}">{text}</text>'
+    "</g></svg>"
+)
+
+
+class Badge(NamedTuple):
+    svg: bytes
+    etag: str
+
+
+@lru_cache(maxsize=4096)
+def char_width(char: str) -> float:
+    if (width := VERDANA_11.get(char)) is not None:
+        return width
+    if unicodedata.combining(char):
+        return 0.0
+    if unicodedata.east_asian_width(char) in ("W", "F"):
+        return WIDE_WIDTH
+    return FALLBACK_WIDTH
+
+
+@lru_cache(maxsize=4096)
+def text_width(text: str) -> float:
+    return sum(map(char_width, text))
+
+
+@lru_cache(maxsize=1024)
+def render_badge(text: str, color: str = "252525") -> Badge:
+    """A shields.io lookalike badge with the Spotify logo, and its ETag."""
+    width = round(text_width(text))
+    left = LOGO_X + LOGO_SIZE + GAP
+    svg = TEMPLATE.format(
+        width=left + width + PADDING,
+        text=escape(text),
+        color=color,
+        logo_x=LOGO_X,
+        logo_size=LOGO_SIZE,
+        logo=SPOTIFY_LOGO,
+        text_x=(left * 2 + width) * 5,
+        text_length=width * 10,
+    ).encode()
+    return Badge(svg, f'"{hashlib.blake2b(svg, digest_size=12).hexdigest()}"')
@@ -0,0 +1,142 @@
+import asyncio
+import os
+from typing import AsyncIterator, Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+def resident_memory() -> int | None:
+    """Bytes of RAM used by this process, if the platform tells us."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Broadcast(Generic[T]):
+    """A value that many streams follow, woken together through one shared future.
+
+    `publish` bumps the version and resolves the current future, there are no
+    per-subscriber events to walk, set and clear. `ping` resolves it without a new
+    version, so every stream sends a heartbeat from a single timer instead of one
+    timer per connection.
+    """
+
+    def __init__(
+        self,
+        value: T,
+        max_subscribers: int,
+        max_age: float,
+        on_active: Callable[[bool], None] | None = None,
+    ):
+        self.value = value
+        self.version = 0
+        self.max_subscribers = max_subscribers
+        self.max_age = max_age
+        self.on_active = on_active
+        self._changed: asyncio.Future[None] | None = None
+        self.closed = False
+
+        self.subscribers = 0
+        self.peak_subscribers = 0
+        self.total_subscribers = 0
+        self.rejected = 0
+        self.expired = 0
+        self.heartbeats = 0
+        self.published = 0
+        self._idle_memory = resident_memory()
+
+    def _wake(self):
+        if self._changed is not None and not self._changed.done():
+            self._changed.set_result(None)
+        self._changed = None
+
+    def publish(self, value: T):
+        if value == self.value:
+            return
+        self.value = value
+        self.version += 1
+        self.published += 1
+        self._wake()
+
+    def close(self):
+        """Ends every stream, and any started later right after its first value."""
+        self.closed = True
+        self._wake()
+
+    def ping(self):
+        if self.subscribers:
+            self.heartbeats += 1
+            self._wake()
+
+    async def run_heartbeat(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.ping()
+
+    async def _next(self):
+        if self._changed is None:
+            self._changed = asyncio.get_running_loop().create_future()
+        # Shielded, so a cancelled stream doesn't cancel everyone else's future.
+        await asyncio.shield(self._changed)
+
+    def full(self) -> bool:
+        if self.subscribers >= self.max_subscribers:
+            self.rejected += 1
+            return True
+        return False
+
+    async def stream(self) -> AsyncIterator[T | None]:
+        """Yields the current value, then every new one. `None` means send a heartbeat.
+
+        Ends after `max_age` seconds so that the client reconnects, which clears out
+        connections that went away without a word, and once the broadcast is closed.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_age
+        version = self.version
+
+        self.subscribers += 1
+        self.total_subscribers += 1
+        self.peak_subscribers = max(self.peak_subscribers, self.subscribers)
+        if self.subscribers == 1 and self.on_active:
+            self.on_active(True)
+        try:
+            yield self.value
+            while not self.closed:
+                if version == self.version:
+                    await self._next()
+                if self.closed:
+                    return
+                if loop.time() > deadline:
+                    self.expired += 1
+                    return
+                if version != self.version:
+                    version = self.version
+                    yield self.value
+                else:
+                    yield None
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers:
+                self._idle_memory = resident_memory()
+                if self.on_active:
+                    self.on_active(False)
+
+    def stats(self) -> dict[str, int | None]:
+        memory, idle = resident_memory(), self._idle_memory
+        per_subscriber = None
+        if self.subscribers and memory is not None and idle is not None:
+            per_subscriber = max(0, memory - idle) // self.subscribers
+        return {
+            "subscribers": self.subscribers,
+            "peak_subscribers": self.peak_subscribers,
+            "total_subscribers": self.total_subscribers,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "heartbeats": self.heartbeats,
+            "published": self.published,
+            "version": self.version,
+            "memory_per_subscriber": per_subscriber,
+        }
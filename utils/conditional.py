@@ -0,0 +1,81 @@
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from functools import cache
+from pathlib import Path
+from typing import NamedTuple
+
+from litestar import Request, Response
+
+import config
+
+#  Everything a page's markup depends on besides its own sources.
+SITE_SOURCES = ("app.py", "routes", "utils", "templates", ".cache/static/manifest.json")
+#  Same setting as in app.py, templates edited in place must not keep their old validators.
+TEMPLATES_AUTO_RELOAD: bool = getattr(config, "TEMPLATES_AUTO_RELOAD", False)
+
+
+def scan_site() -> tuple[int, str]:
+    """Newest mtime and a digest of the code, templates and asset names."""
+    stats: list[str] = []
+    newest = 0
+    for source in map(Path, SITE_SOURCES):
+        files = sorted(source.rglob("*")) if source.is_dir() else [source]
+        for file in files:
+            if file.is_file() and "__pycache__" not in file.parts:
+                stat = file.stat()
+                newest = max(newest, stat.st_mtime_ns)
+                stats.append(f"{file}:{stat.st_mtime_ns}:{stat.st_size}")
+    return newest, hashlib.blake2b("\n".join(stats).encode(), digest_size=8).hexdigest()
+
+
+cached_site_version = cache(scan_site)
+
+
+def site_version() -> tuple[int, str]:
+    """`scan_site()`, computed once since the sources only change with a deploy,
+    which restarts the app. Unless templates reload on change, then every time.
+    """
+    return scan_site() if TEMPLATES_AUTO_RELOAD else cached_site_version()
+
+
+def parse_etags(header: str) -> set[str]:
+    return {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+class Validator(NamedTuple):
+    """An ETag and Last-Modified date for a page, derived from the files it is rendered from."""
+
+    etag: str
+    last_modified: int
+
+    @classmethod
+    def of(cls, mtime_ns: int, *parts: object) -> "Validator":
+        """`mtime_ns` is the newest source mtime, `parts` anything else the page depends on."""
+        site_mtime_ns, site_digest = site_version()
+        key = "\0".join(map(str, (mtime_ns, site_digest, *parts)))
+        digest = hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+        # Pages differ in insignificant ways, like the random gallery thumbnails.
+        return cls(f'W/"{digest}"', max(mtime_ns, site_mtime_ns) // 1_000_000_000)
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {
+            "ETag": self.etag,
+            "Last-Modified": formatdate(self.last_modified, usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+
+    def matches(self, request: Request) -> bool:
+        """Whether the client's copy is current, If-None-Match taking precedence as per RFC 9110."""
+        if (if_none_match := request.headers.get("If-None-Match")) is not None:
+            etags = parse_etags(if_none_match)
+            return "*" in etags or self.etag.removeprefix("W/") in etags
+        if if_modified_since := request.headers.get("If-Modified-Since"):
+            try:
+                return self.last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def not_modified(self, headers: dict[str, str] | None = None) -> Response:
+        return Response(b"", status_code=304, headers={**(headers or {}), **self.headers})
@@ -0,0 +1,111 @@
+"""Deploys without downtime: pull, then replace the workers one at a time.
+
+Under `uvicorn --workers N` the workers are children of uvicorn's supervisor,
+which answers SIGHUP by starting a new worker, waiting until its lifespan
+startup is done (highlighter up, assets built, indexes loaded), and only then
+stopping an old one. Old workers end their SSE streams as soon as they are
+asked to stop, see `on_stop_signal`, so they don't hold up the rollover.
+
+A single process has nobody to take over, so it is restarted with
+`RESTART_COMMAND` instead.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+from pathlib import Path
+from typing import Callable
+
+log = logging.getLogger(__name__)
+
+RESTART_COMMAND = ["sudo", "systemctl", "restart", "might-be-gay.service"]
+#  Seconds `git pull` may take.
+PULL_TIMEOUT = 120
+
+
+def on_stop_signal(callback: Callable[[], None]):
+    """Calls `callback` on the running loop as soon as SIGTERM or SIGINT arrives.
+
+    The server's own handlers still run, but it only gets to the lifespan shutdown
+    after every connection closed, which open streams would otherwise delay.
+    """
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        previous = signal.getsignal(sig)
+
+        def handler(signum: int, frame, previous=previous):
+            loop.call_soon_threadsafe(callback)
+            if callable(previous):
+                previous(signum, frame)
+            elif previous == signal.SIG_DFL:
+                signal.signal(signum, signal.SIG_DFL)
+                signal.raise_signal(signum)
+
+        try:
+            signal.signal(sig, handler)
+        except ValueError:
+            # Not the main thread, whoever runs the app handles stopping it.
+            return
+
+
+class Deployer:
+    def __init__(self, directory: Path, restart_command: list[str] = RESTART_COMMAND):
+        self.directory = directory
+        self.restart_command = restart_command
+        #  One deploy at a time, pushes that come in meanwhile are pulled after it.
+        self.lock = asyncio.Lock()
+        self.tasks: set[asyncio.Task[None]] = set()
+
+    async def run(self, *command: str, timeout: float) -> str | None:
+        """The output of `command`, or None if it failed."""
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            cwd=self.directory,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            log.error("%s took longer than %ss, killed it.", " ".join(command), timeout)
+            return None
+        text = output.decode(errors="replace").strip()
+        if process.returncode:
+            log.error("%s failed: %s", " ".join(command), text)
+            return None
+        return text
+
+    async def reload(self):
+        supervisor = multiprocessing.parent_process()
+        if supervisor is not None and supervisor.pid:
+            log.info("Asking uvicorn (%s) to replace its workers.", supervisor.pid)
+            os.kill(supervisor.pid, signal.SIGHUP)
+        else:
+            log.info("Running alone, restarting with %s.", " ".join(self.restart_command))
+            await self.run(*self.restart_command, timeout=PULL_TIMEOUT)
+
+    async def deploy(self):
+        async with self.lock:
+            before = await self.run("git", "rev-parse", "HEAD", timeout=PULL_TIMEOUT)
+            if await self.run("git", "pull", "--ff-only", timeout=PULL_TIMEOUT) is None:
+                log.error("Pulling failed, still running the old version.")
+                return
+            after = await self.run("git", "rev-parse", "HEAD", timeout=PULL_TIMEOUT)
+            if before is not None and before == after:
+                log.info("Already up to date at %s.", after)
+                return
+            log.info("Pulled %s, reloading.", after)
+            await self.reload()
+
+    def start(self):
+        """Deploys in the background, the webhook shouldn't wait for it."""
+        task = asyncio.create_task(self.deploy())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+
+deployer = Deployer(Path.cwd())
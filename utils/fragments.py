@@ -0,0 +1,36 @@
+"""Template fragments that come out the same on every page, rendered once.
+
+The asset links in every page's <head> and the banner under the navbar only
+depend on their template and on the fingerprinted asset URLs, so they are kept
+until either of those changes. Templates call them as `{{ fragment(name) }}`.
+"""
+
+from typing import NamedTuple
+
+import jinja2
+from markupsafe import Markup
+
+from utils.static_assets import StaticAssets
+
+
+class Rendered(NamedTuple):
+    template: jinja2.Template
+    manifest: dict[str, str]
+    html: Markup
+
+
+class Fragments:
+    def __init__(self, environment: jinja2.Environment, assets: StaticAssets):
+        self.environment = environment
+        self.assets = assets
+        self.rendered: dict[str, Rendered] = {}
+
+    def __call__(self, name: str) -> Markup:
+        # A changed template is a new object, and so is the manifest after a build.
+        template = self.environment.get_template(name)
+        cached = self.rendered.get(name)
+        if cached and cached.template is template and cached.manifest is self.assets.manifest:
+            return cached.html
+        html = Markup(template.render())
+        self.rendered[name] = Rendered(template, self.assets.manifest, html)
+        return html
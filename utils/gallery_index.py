@@ -0,0 +1,252 @@
+import asyncio
+import base64
+import contextlib
+import io
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from utils.shared_files import try_lock
+from utils.watcher import watch_changes
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = Path(".cache/gallery.sqlite3")
+LOCK_PATH = Path(".cache/gallery.lock")
+#  Seconds between checks of the other workers on whether the index is there, or unattended.
+FOLLOW_INTERVAL = 1
+PLACEHOLDER_WIDTH = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS images (
+    folder TEXT NOT NULL REFERENCES folders(name) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    taken_at TEXT,
+    placeholder TEXT,
+    PRIMARY KEY (folder, name)
+);
+"""
+
+
+class ImageInfo(NamedTuple):
+    folder: str
+    name: str
+    size: int
+    mtime_ns: int
+    width: int | None
+    height: int | None
+    taken_at: str | None
+    placeholder: str | None
+
+
+def probe(file: Path) -> tuple[int | None, int | None, str | None, str | None]:
+    """Reads the dimensions, capture date and a tiny blurry placeholder of an image."""
+    try:
+        with PILImage.open(file) as image:
+            exif = image.getexif()
+            width, height = image.size
+            if exif.get(0x0112) in (5, 6, 7, 8):  # Rotated by 90 degrees.
+                width, height = height, width
+
+            taken_at = exif.get_ifd(0x8769).get(36867) or exif.get(306)
+            if isinstance(taken_at, str):
+                date, _, time = taken_at.partition(" ")
+                taken_at = f"{date.replace(':', '-')} {time}".strip()
+            else:
+                taken_at = None
+
+            image.draft("RGB", (PLACEHOLDER_WIDTH * 8, PLACEHOLDER_WIDTH * 8))
+            tiny = ImageOps.exif_transpose(image).convert("RGB")
+            tiny.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH))
+            buffer = io.BytesIO()
+            tiny.save(buffer, "WEBP", quality=40)
+            placeholder = "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode()
+            return width, height, taken_at, placeholder
+    except (OSError, SyntaxError, ValueError):
+        return None, None, None, None
+
+
+class GalleryIndex:
+    """Persistent SQLite index of every image in the galleries.
+
+    A folder is only rescanned when its mtime changes, and inside it only the
+    files whose size or mtime changed are probed again. Only the worker holding
+    the lock writes to it, the others read what it wrote, and take over when it
+    goes away.
+    """
+
+    def __init__(self, source: Path, database: Path = INDEX_FILE, lock_path: Path = LOCK_PATH):
+        self.source = source
+        self.database = database
+        self.lock_path = lock_path
+        self.lock_fd: int | None = None
+        self.write_lock = threading.Lock()
+        self._reader: sqlite3.Connection | None = None
+        self.ready = False
+
+    def connect(self, readonly: bool = False) -> sqlite3.Connection:
+        if readonly:
+            uri = self.database.resolve().as_uri() + "?mode=ro"
+            return sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.database.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.database, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        connection.executescript(SCHEMA)
+        return connection
+
+    @property
+    def reader(self) -> sqlite3.Connection:
+        if self._reader is None:
+            self._reader = self.connect(readonly=True)
+        return self._reader
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    def folders(self) -> list[str]:
+        return [name for name, in self.reader.execute("SELECT name FROM folders ORDER BY name")]
+
+    def has_folder(self, folder: str) -> bool:
+        query = "SELECT 1 FROM folders WHERE name = ?"
+        return self.reader.execute(query, (folder,)).fetchone() is not None
+
+    def mtimes(self, folder: str | None = None) -> dict[str, int]:
+        """Newest mtime of each folder or its images, as of the last sync."""
+        query = """
+            SELECT folders.name, max(folders.mtime_ns, coalesce(max(images.mtime_ns), 0))
+            FROM folders LEFT JOIN images ON images.folder = folders.name
+            WHERE ?1 IS NULL OR folders.name = ?1 GROUP BY folders.name
+        """
+        return dict(self.reader.execute(query, (folder,)))
+
+    def images(
+        self, folder: str, after: str | None = None, limit: int = -1
+    ) -> list[ImageInfo]:
+        """Images of `folder` in reverse name order, starting after the `after` cursor."""
+        if after is None:
+            query = "SELECT * FROM images WHERE folder = ? ORDER BY name DESC LIMIT ?"
+            params = (folder, limit)
+        else:
+            query = "SELECT * FROM images WHERE folder = ? AND name < ? ORDER BY name DESC LIMIT ?"
+            params = (folder, after, limit)
+        return [ImageInfo(*row) for row in self.reader.execute(query, params)]
+
+    def random_images(self) -> dict[str, ImageInfo]:
+        """One random image of every folder."""
+        query = """
+            SELECT folder, name, size, mtime_ns, width, height, taken_at, placeholder FROM (
+                SELECT *, row_number() OVER (PARTITION BY folder ORDER BY random()) AS n FROM images
+            ) WHERE n = 1
+        """
+        return {row[0]: ImageInfo(*row) for row in self.reader.execute(query)}
+
+    def sync(self):
+        with self.write_lock, contextlib.closing(self.connect()) as db:
+            known = dict(db.execute("SELECT name, mtime_ns FROM folders"))
+            present = set()
+            for folder in self.source.iterdir():
+                if not folder.is_dir():
+                    continue
+                present.add(folder.name)
+                mtime_ns = folder.stat().st_mtime_ns
+                if known.get(folder.name) != mtime_ns:
+                    self._sync_folder(db, folder, mtime_ns)
+                    db.commit()
+
+            for removed in known.keys() - present:
+                db.execute("DELETE FROM folders WHERE name = ?", (removed,))
+            # Tells the other workers the index is complete.
+            db.execute("PRAGMA user_version = 1")
+            db.commit()
+
+    def _sync_folder(self, db: sqlite3.Connection, folder: Path, mtime_ns: int):
+        log.info("Indexing gallery folder %s.", folder.name)
+        query = "SELECT name, size, mtime_ns FROM images WHERE folder = ?"
+        known = {name: (size, mtime) for name, size, mtime in db.execute(query, (folder.name,))}
+        db.execute(
+            "INSERT INTO folders VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET mtime_ns = excluded.mtime_ns",
+            (folder.name, mtime_ns),
+        )
+
+        present = set()
+        for file in folder.iterdir():
+            if not file.is_file() or file.name == "README.md":
+                continue
+            present.add(file.name)
+            stat = file.stat()
+            if known.get(file.name) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            db.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (folder.name, file.name, stat.st_size, stat.st_mtime_ns, *probe(file)),
+            )
+
+        db.executemany(
+            "DELETE FROM images WHERE folder = ? AND name = ?",
+            [(folder.name, name) for name in known.keys() - present],
+        )
+
+    def _synced(self) -> bool:
+        """Whether a complete index is there to read."""
+        if not self.database.exists():
+            return False
+        with contextlib.closing(self.connect(readonly=True)) as db:
+            return db.execute("PRAGMA user_version").fetchone()[0] >= 1
+
+    def _elect(self) -> bool:
+        """Whether this worker keeps the index up to date, taking over if nobody does."""
+        if self.lock_fd is None and (fd := try_lock(self.lock_path)) is not None:
+            self.lock_fd = fd
+            log.info("Process %s is indexing the galleries.", os.getpid())
+        return self.lock_fd is not None
+
+    async def _sync_safely(self):
+        try:
+            await asyncio.to_thread(self.sync)
+        except (OSError, sqlite3.Error):
+            log.exception("Failed updating the gallery index.")
+
+    async def load(self) -> bool:
+        """Picks up an index written before, after which it is `ready` to answer listings.
+
+        Nothing waits for the first sync, which can take minutes for a big gallery.
+        It happens in `run`, and until then galleries are listed from the folders.
+        """
+        if not self.source.is_dir():
+            log.warning("Not indexing galleries, %s does not exist.", self.source)
+            return False
+        self._elect()
+        self.ready = await asyncio.to_thread(self._synced)
+        return self.ready
+
+    async def run(self):
+        if not self.source.is_dir():
+            return
+        while not self._elect():
+            self.ready = self.ready or await asyncio.to_thread(self._synced)
+            await asyncio.sleep(FOLLOW_INTERVAL)
+        # Whatever changed while no worker was keeping the index.
+        await self._sync_safely()
+        self.ready = self.ready or await asyncio.to_thread(self._synced)
+        async for _ in watch_changes(self.source):
+            await self._sync_safely()
@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple
+
+from utils.timing import phase
+
+CACHE_DIR = Path(".cache/highlight")
+#  Bumped whenever what gets cached changes, so older entries stop matching.
+FORMAT = 2
+
+
+class CacheKey(NamedTuple):
+    path: str
+    mtime_ns: int
+    size: int
+    lang: str
+    theme: str
+    lines: str = ""
+    engine: str = ""
+
+    @classmethod
+    def for_file(
+        cls, file: Path, lang: str, theme: str, lines: str = "", engine: str = ""
+    ) -> "CacheKey":
+        resolved = file.resolve()
+        stat = resolved.stat()
+        return cls(
+            resolved.as_posix(), stat.st_mtime_ns, stat.st_size, lang, theme, lines, engine
+        )
+
+    @property
+    def version(self) -> str:
+        return f"{FORMAT}-{self.mtime_ns}-{self.size}"
+
+    @property
+    def path_digest(self) -> str:
+        return hashlib.sha256(self.path.encode()).hexdigest()[:32]
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256("\0".join(map(str, self)).encode()).hexdigest()
+
+
+class HighlightCache:
+    """Two-tier cache of highlighted HTML: a size-bounded LRU in memory, backed by files on disk.
+
+    Keys contain the file's mtime and size, so an edited file simply stops matching
+    its old entries. On disk, every version of a source file gets its own folder
+    and writing to a new version removes the stale ones. Once the disk tier grows
+    past `max_disk_bytes`, the entries used least recently are removed.
+    """
+
+    def __init__(
+        self,
+        directory: Path = CACHE_DIR,
+        max_entries: int = 512,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        #  What this process thinks is on disk, counted on the first write.
+        self.disk_bytes: int | None = None
+        self.memory: OrderedDict[CacheKey, str] = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self.memory),
+            "bytes": self.memory_bytes,
+        }
+
+    def _disk_path(self, key: CacheKey) -> Path:
+        return self.directory / key.path_digest / key.version / f"{key.digest}.html"
+
+    def _remember(self, key: CacheKey, html: str):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        size = len(html)
+        if size > self.max_bytes:
+            return
+        self.memory[key] = html
+        self.memory_bytes += size
+        while len(self.memory) > self.max_entries or self.memory_bytes > self.max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _read_disk(self, key: CacheKey) -> str | None:
+        file = self._disk_path(key)
+        try:
+            html = file.read_text()
+            # Its mtime says when it was last used, see `_prune_disk`.
+            os.utime(file)
+            return html
+        except OSError:
+            return None
+
+    def _prune_disk(self):
+        entries = []
+        for file in self.directory.rglob("*.html"):
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file))
+        total = sum(size for _, size, _ in entries)
+        # Down to three quarters, so that this doesn't run on every write.
+        for _, size, file in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_disk_bytes * 3 // 4:
+                break
+            file.unlink(missing_ok=True)
+            total -= size
+            for folder in (file.parent, file.parent.parent):
+                try:
+                    folder.rmdir()
+                except OSError:
+                    break
+        self.disk_bytes = total
+
+    def _write_disk(self, key: CacheKey, html: str):
+        file = self._disk_path(key)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        for stale in file.parent.parent.iterdir():
+            if stale.name != key.version:
+                shutil.rmtree(stale, ignore_errors=True)
+        tmp = file.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(html)
+        tmp.replace(file)
+        if self.disk_bytes is not None:
+            self.disk_bytes += len(html)
+        if self.disk_bytes is None or self.disk_bytes > self.max_disk_bytes:
+            self._prune_disk()
+
+    async def get(self, key: CacheKey) -> str | None:
+        if (html := self.memory.get(key)) is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return html
+
+        with phase("fs"):
+            html = await asyncio.to_thread(self._read_disk, key)
+        if html is None:
+            self.misses += 1
+            return None
+
+        self.disk_hits += 1
+        self._remember(key, html)
+        return html
+
+    async def set(self, key: CacheKey, html: str):
+        self._remember(key, html)
+        try:
+            await asyncio.to_thread(self._write_disk, key, html)
+        except OSError:
+            pass  # The memory tier still works if the disk is read-only.
+
+
+highlight_cache = HighlightCache()
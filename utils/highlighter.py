@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, NamedTuple, Protocol
+
+import aiohttp
+
+import config
+from utils.timing import phase
+
+log = logging.getLogger(__name__)
+
+#  Either "shiki" (node processes) or "pygments" (in-process).
+BACKEND: str = getattr(config, "HIGHLIGHTER", "shiki")
+WORKERS: int = getattr(config, "HIGHLIGHTER_WORKERS", min(4, os.cpu_count() or 1))
+COMMAND: list[str] = getattr(config, "HIGHLIGHTER_COMMAND", ["node", "utils/shiki.js"])
+HEALTH_INTERVAL = 5
+STARTUP_GRACE = 30
+MAX_FAILED_CHECKS = 3
+MIN_BACKOFF, MAX_BACKOFF = 0.5, 30
+STABLE_AFTER = 60
+PICK_TIMEOUT = 2
+
+
+class CodeBlock(NamedTuple):
+    code: str
+    lang: str
+
+
+class HighlighterUnavailable(Exception):
+    """No highlighter worker is healthy right now."""
+
+
+class Highlighter(Protocol):
+    name: str
+
+    async def start(self) -> None: ...
+
+    async def wait_ready(self, timeout: float) -> bool: ...
+
+    def is_ready(self) -> bool: ...
+
+    async def stop(self) -> None: ...
+
+    async def highlight_blocks(self, blocks: list[CodeBlock], theme: str) -> list[str]: ...
+
+
+class Worker:
+    """One `utils/shiki.js` process, listening on its own Unix socket."""
+
+    def __init__(self, index: int, socket: Path, command: list[str]):
+        self.index = index
+        self.socket = socket
+        self.command = command
+        self.process: asyncio.subprocess.Process | None = None
+        self.session: aiohttp.ClientSession | None = None
+        self.healthy = False
+        self.in_flight = 0
+        self.restarts = 0
+
+    def __repr__(self):
+        pid = self.process and self.process.pid
+        return f"<Worker {self.index} pid={pid} healthy={self.healthy}>"
+
+    async def spawn(self):
+        self.socket.unlink(missing_ok=True)
+        self.process = await asyncio.create_subprocess_exec(*self.command, str(self.socket))
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.UnixConnector(path=str(self.socket)),
+            timeout=aiohttp.ClientTimeout(total=30),
+        )
+
+    async def check(self) -> bool:
+        if not self.session or not self.socket.exists():
+            return False
+        try:
+            async with self.session.get(
+                "http://shiki/health", timeout=aiohttp.ClientTimeout(total=2)
+            ) as resp:
+                return resp.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def exited(self, timeout: float) -> bool:
+        """Waits up to `timeout` seconds for the process to exit."""
+        assert self.process
+        try:
+            await asyncio.wait_for(asyncio.shield(self.process.wait()), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self):
+        self.healthy = False
+        if self.session:
+            await self.session.close()
+            self.session = None
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+            if not await self.exited(5):
+                self.process.kill()
+                await self.process.wait()
+        self.socket.unlink(missing_ok=True)
+
+
+class HighlighterPool:
+    """Supervises a pool of shiki workers.
+
+    Every worker is health-checked periodically and restarted with exponential
+    backoff when it dies or stops answering. Requests go to the healthy worker
+    with the fewest requests in flight.
+    """
+
+    name = "shiki"
+
+    def __init__(self, size: int = WORKERS, command: list[str] = COMMAND):
+        self.size = max(1, size)
+        self.command = command
+        self.workers: list[Worker] = []
+        self.tasks: list[asyncio.Task] = []
+        self.directory: Path | None = None
+        self.ready = asyncio.Event()
+
+    async def start(self):
+        self.directory = Path(tempfile.mkdtemp(prefix=f"shiki-{os.getpid()}-"))
+        self.workers = [
+            Worker(index, self.directory / f"{index}.sock", self.command)
+            for index in range(self.size)
+        ]
+        self.tasks = [asyncio.create_task(self.supervise(worker)) for worker in self.workers]
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Waits until at least one worker is healthy."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def is_ready(self) -> bool:
+        return self.ready.is_set()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _update_ready(self):
+        if any(worker.healthy for worker in self.workers):
+            self.ready.set()
+        else:
+            self.ready.clear()
+
+    async def supervise(self, worker: Worker):
+        loop = asyncio.get_running_loop()
+        backoff = MIN_BACKOFF
+        while True:
+            await worker.spawn()
+            started = loop.time()
+            failed_checks = 0
+
+            while not await worker.exited(HEALTH_INTERVAL if worker.healthy else 0.25):
+                if await worker.check():
+                    worker.healthy, failed_checks = True, 0
+                elif worker.healthy or loop.time() - started > STARTUP_GRACE:
+                    failed_checks += 1
+                    worker.healthy = False
+                    if failed_checks >= MAX_FAILED_CHECKS:
+                        log.warning("%r stopped answering health checks.", worker)
+                        break
+                self._update_ready()
+
+            await worker.stop()
+            self._update_ready()
+            worker.restarts += 1
+
+            if loop.time() - started > STABLE_AFTER:
+                backoff = MIN_BACKOFF
+            log.warning("Restarting highlighter worker %s in %.1fs.", worker.index, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    async def pick(self) -> Worker:
+        # Give a restarting worker a moment to come back before giving up.
+        if not self.ready.is_set() and not await self.wait_ready(PICK_TIMEOUT):
+            raise HighlighterUnavailable()
+        healthy = [worker for worker in self.workers if worker.healthy]
+        if not healthy:
+            raise HighlighterUnavailable()
+        return min(healthy, key=lambda worker: worker.in_flight)
+
+    async def request(self, path: str, payload: Any) -> Any:
+        for attempt in range(2):
+            worker = await self.pick()
+            worker.in_flight += 1
+            try:
+                assert worker.session
+                async with worker.session.post(f"http://shiki{path}", json=payload) as resp:
+                    resp.raise_for_status()
+                    return await resp.json()
+            except aiohttp.ClientConnectionError:
+                # Let the supervisor find out what happened, and try another worker.
+                worker.healthy = False
+                self._update_ready()
+                if attempt:
+                    raise
+            except asyncio.TimeoutError as error:
+                # Not worth waiting that long again, the health checks will tell if it's stuck.
+                raise HighlighterUnavailable(f"{worker!r} took too long.") from error
+            finally:
+                worker.in_flight -= 1
+
+    async def highlight_blocks(self, blocks: list[CodeBlock], theme: str) -> list[str]:
+        """Highlights every block in a single round trip to a shiki worker."""
+        return await self.request(
+            "/hlbatch", dict(theme=theme, blocks=[block._asdict() for block in blocks])
+        )
+
+
+def create_backend(name: str) -> Highlighter:
+    if name == "pygments":
+        from utils.pygments_highlighter import PygmentsHighlighter
+
+        return PygmentsHighlighter()
+    if name == "shiki":
+        return HighlighterPool()
+    raise ValueError(f"Unknown highlighter backend {name!r}.")
+
+
+backend = create_backend(BACKEND)
+
+
+async def highlight_blocks(blocks: list[CodeBlock], theme: str = "vitesse-dark") -> list[str]:
+    if not blocks:
+        return []
+    with phase("highlight"):
+        return await backend.highlight_blocks(blocks, theme)
+
+
+async def highlight_code(code: str, lang: str, theme: str = "vitesse-dark") -> str:
+    return (await highlight_blocks([CodeBlock(code, lang)], theme))[0]
@@ -0,0 +1,84 @@
+import threading
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple
+
+STRIDE = 256
+
+
+class LineIndex(NamedTuple):
+    """Byte offset of every `STRIDE`th line of a file, so a range can be read with one seek."""
+
+    offsets: array
+    total_lines: int
+
+
+class LineReader:
+    """Reads line ranges out of text files, remembering where their lines start.
+
+    The first read of a file scans it completely (picking up the requested range
+    on the way), every later read seeks close to the range and stops after it.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.indexes: OrderedDict[tuple[str, int, int], LineIndex] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _scan(self, file, start: int, stop: int) -> tuple[list[bytes], LineIndex]:
+        offsets = array("Q", [0])
+        lines: list[bytes] = []
+        position = number = 0
+        for number, line in enumerate(file, start=1):
+            if start <= number <= stop:
+                lines.append(line)
+            position += len(line)
+            if number % STRIDE == 0:
+                offsets.append(position)
+        return lines, LineIndex(offsets, number)
+
+    def _seek(self, file, index: LineIndex, start: int, stop: int) -> list[bytes]:
+        block = (start - 1) // STRIDE
+        if block >= len(index.offsets):
+            return []
+        file.seek(index.offsets[block])
+        lines: list[bytes] = []
+        for number, line in enumerate(file, start=block * STRIDE + 1):
+            if number > stop:
+                break
+            if number >= start:
+                lines.append(line)
+        return lines
+
+    def read(self, path: Path, key: tuple[str, int, int], start: int, stop: int) -> tuple[str, int]:
+        """Returns lines `start` to `stop` (1-based, inclusive) and the file's line count.
+
+        `key` identifies the file's version, usually its path, mtime and size.
+        Raises UnicodeDecodeError for files that are not UTF-8 text.
+        """
+        with self.lock:
+            if (index := self.indexes.get(key)) is not None:
+                self.indexes.move_to_end(key)
+
+        with path.open("rb") as file:
+            if index is not None:
+                lines = self._seek(file, index, start, stop)
+            else:
+                lines, index = self._scan(file, start, stop)
+                with self.lock:
+                    self.indexes[key] = index
+                    if len(self.indexes) > self.max_entries:
+                        self.indexes.popitem(last=False)
+        return b"".join(lines).decode("utf-8"), index.total_lines
+
+    def total_lines(self, path: Path, key: tuple[str, int, int]) -> int:
+        """The line count of `path`, which is only read if it wasn't read before."""
+        with self.lock:
+            if (index := self.indexes.get(key)) is not None:
+                self.indexes.move_to_end(key)
+                return index.total_lines
+        return self.read(path, key, 1, 0)[1]
+
+
+line_reader = LineReader()
@@ -1,6 +1,8 @@
 from enum import Enum
+from functools import lru_cache
 from typing import Literal, NamedTuple
 from jinja2.filters import do_mark_safe
+from markupsafe import Markup
 
 
 class Link(NamedTuple):
@@ -36,7 +38,14 @@ class Links(Enum):
         return self.value.link
 
     def __call__(self, mask: str | None = None, **extra: str):
-        extra.setdefault("href", self.value.link)
-        extra.setdefault("target", self.value.target)
-        extra_fmt = " ".join(f"{k}={v!r}" for k, v in extra.items())
-        return do_mark_safe(f"<a {extra_fmt}>{mask or self.value[1]}</a>")
+        return anchor(self, mask, tuple(extra.items()))
+
+
+@lru_cache(maxsize=256)
+def anchor(link: Links, mask: str | None, extra: tuple[tuple[str, str], ...]) -> Markup:
+    """The same few links are on every page, they are formatted once."""
+    attributes = dict(extra)
+    attributes.setdefault("href", link.value.link)
+    attributes.setdefault("target", link.value.target)
+    extra_fmt = " ".join(f"{k}={v!r}" for k, v in attributes.items())
+    return do_mark_safe(f"<a {extra_fmt}>{mask or link.value[1]}</a>")
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, NamedTuple
+
+import aiohttp
+
+from utils.broadcast import Broadcast
+from utils.shared_files import try_lock
+
+log = logging.getLogger(__name__)
+
+LOCK_PATH = Path(".cache/now-playing.lock")
+SOCKET_PATH = Path(".cache/now-playing.sock")
+RECONNECT_DELAY = 0.5
+HEARTBEAT_INTERVAL = 15
+MAX_STREAM_AGE = 60 * 60
+
+
+class Poll(NamedTuple):
+    html: str | None
+    """None when the source says nothing changed."""
+    playing: bool
+
+
+class PollError(Exception):
+    """The source answered, but not with something usable."""
+
+
+class RateLimited(PollError):
+    def __init__(self, retry_after: float | None = None):
+        super().__init__(f"Rate limited, retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+
+Fetcher = Callable[[aiohttp.ClientSession], Awaitable[Poll]]
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait according to a Retry-After header, in either of its formats."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class PollScheduler:
+    """Decides how long to wait before the next poll.
+
+    While something is playing, or the last poll saw a change, it polls every
+    `fast` seconds. Every unchanged idle poll waits 1.5 times longer, up to
+    `idle`. Errors back off exponentially from `error_min` to `error_max`, with
+    jitter so that restarts don't line up. A Retry-After is never undercut.
+    """
+
+    def __init__(
+        self, fast: float = 2, idle: float = 60, error_min: float = 5, error_max: float = 300
+    ):
+        self.fast = fast
+        self.idle = idle
+        self.error_min = error_min
+        self.error_max = error_max
+        self.delay = fast
+        self.errors = 0
+
+    def success(self, poll: Poll, changed: bool) -> float:
+        self.errors = 0
+        if poll.playing or changed:
+            self.delay = self.fast
+        else:
+            self.delay = min(self.delay * 1.5, self.idle)
+        return self.delay
+
+    def failure(self, retry_after: float | None = None) -> float:
+        self.errors += 1
+        ceiling = min(self.error_max, self.error_min * 2 ** (self.errors - 1))
+        delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+        return max(delay, retry_after or 0)
+
+    def reset(self):
+        """Someone new is watching, poll fast again."""
+        self.delay = self.fast
+
+
+class NowPlayingHub:
+    """Shares the now-playing HTML between every worker process.
+
+    The workers elect a leader with an exclusive `flock`. Only the leader calls
+    `fetch`, and only while some worker has subscribers. It publishes every change
+    over a Unix socket, and each worker wakes its own subscribers. When the leader
+    dies its lock is released and one of the followers takes over. How often the
+    leader polls is up to a `PollScheduler`.
+
+    Messages are newline separated JSON. The leader sends `{"html": ...}`, followers
+    send `{"active": bool}` when they gain their first or lose their last subscriber.
+
+    Within a worker, subscribers follow a `Broadcast`.
+    """
+
+    def __init__(
+        self,
+        fetch: Fetcher,
+        initial: str,
+        scheduler: PollScheduler | None = None,
+        max_subscribers: int = 10_000,
+        heartbeat: float = HEARTBEAT_INTERVAL,
+        lock_path: Path = LOCK_PATH,
+        socket_path: Path = SOCKET_PATH,
+    ):
+        self.fetch = fetch
+        self.scheduler = scheduler or PollScheduler()
+        self.heartbeat = heartbeat
+        self.lock_path = lock_path
+        self.socket_path = socket_path
+        self.broadcast = Broadcast(
+            initial, max_subscribers, MAX_STREAM_AGE, on_active=self._subscribers_changed
+        )
+        self.leader = False
+        # Leader side: connected followers, and whether each has subscribers.
+        self.followers: dict[asyncio.StreamWriter, bool] = {}
+        self.demand = asyncio.Event()
+        # Follower side: the connection to the leader.
+        self.upstream: asyncio.StreamWriter | None = None
+
+    @property
+    def html(self) -> str:
+        return self.broadcast.value
+
+    @property
+    def active(self) -> bool:
+        return bool(self.broadcast.subscribers) or any(self.followers.values())
+
+    def _subscribers_changed(self, active: bool):
+        if self.leader:
+            self.demand.set()
+        elif self.upstream:
+            self.upstream.write(json.dumps({"active": active}).encode() + b"\n")
+
+    def full(self) -> bool:
+        return self.broadcast.full()
+
+    def close(self):
+        """Ends every stream, so that clients move on to another worker."""
+        self.broadcast.close()
+
+    def stream(self) -> AsyncIterator[str | None]:
+        """The current HTML and then every change, with `None` for heartbeats."""
+        return self.broadcast.stream()
+
+    def stats(self) -> dict[str, int | None]:
+        return {
+            "leader": int(self.leader),
+            "followers": len(self.followers),
+            **self.broadcast.stats(),
+        }
+
+    async def run(self, session: aiohttp.ClientSession):
+        heartbeat = asyncio.create_task(self.broadcast.run_heartbeat(self.heartbeat))
+        try:
+            await self._elect(session)
+        finally:
+            heartbeat.cancel()
+
+    async def _elect(self, session: aiohttp.ClientSession):
+        while True:
+            if (fd := try_lock(self.lock_path)) is not None:
+                try:
+                    await self._lead(session)
+                finally:
+                    os.close(fd)
+            else:
+                try:
+                    await self._follow()
+                except (ConnectionError, FileNotFoundError):
+                    # The leader hasn't opened its socket yet, or just went away.
+                    await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _lead(self, session: aiohttp.ClientSession):
+        log.info("Process %s is polling for now-playing updates.", os.getpid())
+        self.leader = True
+        self.socket_path.unlink(missing_ok=True)
+        server = await asyncio.start_unix_server(self._serve_follower, path=self.socket_path)
+        loop = asyncio.get_running_loop()
+        next_poll = hold_until = loop.time()
+        try:
+            while True:
+                if self.active and loop.time() >= next_poll:
+                    delay, backing_off = await self._poll(session)
+                    next_poll = loop.time() + delay
+                    hold_until = next_poll if backing_off else 0
+                # Anyone who asked for an update while that fetch ran got its result.
+                self.demand.clear()
+                timeout = max(0, next_poll - loop.time()) if self.active else None
+                try:
+                    await asyncio.wait_for(self.demand.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    # New subscribers get fresh data now, unless we are backing off.
+                    self.scheduler.reset()
+                    next_poll = max(hold_until, loop.time())
+        finally:
+            self.leader = False
+            server.close()
+            for writer in self.followers:
+                writer.close()
+            self.followers.clear()
+            self.socket_path.unlink(missing_ok=True)
+
+    async def _poll(self, session: aiohttp.ClientSession) -> tuple[float, bool]:
+        """Fetches once, returning the delay until the next poll and whether it is a backoff."""
+        try:
+            poll = await self.fetch(session)
+        except RateLimited as error:
+            log.warning("Now-playing source is rate limiting us (Retry-After: %s).", error.retry_after)
+            return self.scheduler.failure(error.retry_after), True
+        except (aiohttp.ClientError, asyncio.TimeoutError, PollError, ValueError) as error:
+            log.warning("Failed fetching now-playing: %r", error)
+            return self.scheduler.failure(), True
+        changed = poll.html is not None and self._publish(poll.html)
+        return self.scheduler.success(poll, changed), False
+
+    def _publish(self, html: str) -> bool:
+        if html == self.html:
+            return False
+        self.broadcast.publish(html)
+        message = json.dumps({"html": html}).encode() + b"\n"
+        for writer in self.followers:
+            writer.write(message)
+        return True
+
+    async def _serve_follower(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.followers[writer] = False
+        writer.write(json.dumps({"html": self.html}).encode() + b"\n")
+        try:
+            async for line in reader:
+                active = json.loads(line)["active"]
+                if active and not self.active:
+                    self.demand.set()
+                self.followers[writer] = active
+        except (ConnectionError, ValueError, KeyError):
+            pass
+        finally:
+            self.followers.pop(writer, None)
+            writer.close()
+
+    async def _follow(self):
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        self.upstream = writer
+        try:
+            if self.broadcast.subscribers:
+                self._subscribers_changed(True)
+            async for line in reader:
+                self.broadcast.publish(json.loads(line)["html"])
+        finally:
+            self.upstream = None
+            writer.close()
+        log.info("Lost the now-playing leader, holding a new election.")
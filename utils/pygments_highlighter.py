@@ -0,0 +1,131 @@
+import asyncio
+from functools import lru_cache
+from html import escape
+from typing import TYPE_CHECKING
+
+from pygments.lexer import Lexer
+from pygments.lexers import TextLexer, get_lexer_by_name, get_lexer_for_filename
+from pygments.styles import get_style_by_name
+from pygments.token import Token, _TokenType
+from pygments.util import ClassNotFound
+
+if TYPE_CHECKING:
+    from utils.highlighter import CodeBlock
+
+#  Languages whose lexers are loaded at startup, the rest are loaded on first use.
+WARM_LANGUAGES = ("py", "js", "ts", "json", "html", "css", "bash", "md", "toml", "yaml", "txt")
+#  Themes used by the site, code files and markdown respectively.
+WARM_THEMES = ("github-dark", "vitesse-dark")
+#  Shiki themes that have no Pygments style with the same name.
+THEMES = {"vitesse-dark": "github-dark"}
+
+
+class Theme:
+    """CSS for every token type of a Pygments style, computed once per token type."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.style = get_style_by_name(THEMES.get(name, name))
+        self.css: dict[_TokenType, str] = {}
+        self.foreground = self.for_token(Token.Text) or "color:#e1e4e8"
+
+    def for_token(self, token: _TokenType) -> str:
+        if (css := self.css.get(token)) is None:
+            style = self.style.style_for_token(token)
+            rules = []
+            if style["color"]:
+                rules.append(f"color:#{style['color']}")
+            if style["bold"]:
+                rules.append("font-weight:bold")
+            if style["italic"]:
+                rules.append("font-style:italic")
+            if style["underline"]:
+                rules.append("text-decoration:underline")
+            css = self.css[token] = ";".join(rules)
+        return css
+
+
+class PygmentsHighlighter:
+    """In-process highlighting, emitting the same `pre > code > span.line` markup as shiki."""
+
+    name = "pygments"
+
+    def __init__(self, warm_languages: tuple[str, ...] = WARM_LANGUAGES):
+        self.warm_languages = warm_languages
+        self.lexers: dict[str, Lexer] = {}
+
+    def lexer(self, lang: str) -> Lexer:
+        if (lexer := self.lexers.get(lang)) is None:
+            options = dict(stripnl=False, ensurenl=False)
+            try:
+                lexer = get_lexer_by_name(lang, **options)
+            except ClassNotFound:
+                try:
+                    lexer = get_lexer_for_filename(f"file.{lang}", **options)
+                except ClassNotFound:
+                    lexer = TextLexer(**options)
+            self.lexers[lang] = lexer
+        return lexer
+
+    @staticmethod
+    @lru_cache
+    def theme(name: str) -> Theme:
+        try:
+            return Theme(name)
+        except ClassNotFound:
+            return Theme("github-dark")
+
+    def highlight(self, code: str, lang: str, theme_name: str) -> str:
+        theme = self.theme(theme_name)
+        # Every line is a list of [css, text] runs, neighbouring tokens with the same style share a run.
+        lines: list[list[list[str]]] = [[]]
+        for token, value in self.lexer(lang).get_tokens(code):
+            css = theme.for_token(token)
+            for index, part in enumerate(value.split("\n")):
+                if index:
+                    lines.append([])
+                if not part:
+                    continue
+                if lines[-1] and lines[-1][-1][0] == css:
+                    lines[-1][-1][1] += part
+                else:
+                    lines[-1].append([css, part])
+
+        body = "\n".join(
+            '<span class="line">'
+            + "".join(
+                f'<span style="{css}">{escape(text, quote=False)}</span>'
+                if css
+                else escape(text, quote=False)
+                for css, text in line
+            )
+            + "</span>"
+            for line in lines
+        )
+        return (
+            f'<pre class="pygments {theme.name}" style="background-color:{theme.style.background_color};'
+            f'{theme.foreground}" tabindex="0"><code>{body}</code></pre>'
+        )
+
+    async def start(self):
+        def warm():
+            for lang in self.warm_languages:
+                self.lexer(lang)
+            for theme in WARM_THEMES:
+                self.theme(theme)
+
+        await asyncio.to_thread(warm)
+
+    async def wait_ready(self, timeout: float) -> bool:
+        return True
+
+    def is_ready(self) -> bool:
+        return True
+
+    async def stop(self):
+        pass
+
+    async def highlight_blocks(self, blocks: "list[CodeBlock]", theme: str) -> list[str]:
+        return await asyncio.to_thread(
+            lambda: [self.highlight(block.code, block.lang, theme) for block in blocks]
+        )
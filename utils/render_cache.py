@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable, NamedTuple
+
+from markupsafe import Markup
+
+from utils.timing import phase
+
+log = logging.getLogger(__name__)
+
+Renderer = Callable[[str], Awaitable[Markup]]
+
+
+class RenderedFile(NamedTuple):
+    mtime_ns: int
+    html: Markup
+
+
+class RenderCache:
+    """Keeps the rendered HTML of markdown files in memory.
+
+    `run` re-renders every source whose mtime changed in the background, so
+    request handlers can serve straight from `get` without touching disk.
+    """
+
+    def __init__(self, render: Renderer, sources: Callable[[], Iterable[Path]]):
+        self.render = render
+        self.sources = sources
+        self.rendered: dict[Path, RenderedFile] = {}
+        self.pending: dict[Path, asyncio.Task[Markup]] = {}
+
+    def get(self, file: Path) -> Markup | None:
+        if entry := self.rendered.get(file):
+            return entry.html
+
+    def entry(self, file: Path) -> RenderedFile | None:
+        return self.rendered.get(file)
+
+    async def _render(self, file: Path) -> Markup:
+        with phase("fs"):
+            mtime_ns = (await asyncio.to_thread(file.stat)).st_mtime_ns
+            markdown = await asyncio.to_thread(file.read_text)
+        html = await self.render(markdown)
+        self.rendered[file] = RenderedFile(mtime_ns, html)
+        return html
+
+    async def load(self, file: Path) -> Markup:
+        """Renders `file` now, sharing the work with anyone already rendering it."""
+        if not (task := self.pending.get(file)):
+            task = self.pending[file] = asyncio.create_task(self._render(file))
+            task.add_done_callback(lambda _: self.pending.pop(file, None))
+        return await asyncio.shield(task)
+
+    def _stale(self) -> tuple[list[Path], list[Path]]:
+        changed: list[Path] = []
+        seen: set[Path] = set()
+        for file in self.sources():
+            seen.add(file)
+            try:
+                mtime_ns = file.stat().st_mtime_ns
+            except OSError:
+                continue
+            entry = self.rendered.get(file)
+            if not entry or entry.mtime_ns != mtime_ns:
+                changed.append(file)
+        return changed, [file for file in self.rendered if file not in seen]
+
+    async def refresh(self):
+        changed, removed = await asyncio.to_thread(self._stale)
+        for file in removed:
+            self.rendered.pop(file, None)
+        for file in changed:
+            try:
+                await self.load(file)
+            except Exception:
+                log.exception("Failed rendering %s, will retry later.", file)
+
+    async def run(self, interval: float = 5):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(interval)
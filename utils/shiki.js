@@ -1,33 +1,44 @@
-import { codeToHtml, splitLines } from 'shiki';
+import { codeToHtml } from 'shiki';
 import express from 'express';
-import { readFileSync } from 'fs';
+import { unlinkSync } from 'fs';
 
 const app = express();
-app.use(express.json({ strict: false }));
+app.use(express.json({ strict: false, limit: '16mb' }));
 
 
-app.get("/hl", async (req, res, next) => {
-    let file = req.query.path;
-
-    var contents = readFileSync(file, 'utf8');
-    var split = file.split('.');
-    var html = await codeToHtml(contents, {
-        lang: req.query.lang || split[split.length - 1], theme: req.query.theme || 'vitesse-dark'
-    });
-    res.send(html);
+app.post("/hlbatch", async (req, res, next) => {
+    let { blocks, theme } = req.body;
+    var html = await Promise.all(blocks.map(async (block) => {
+        try {
+            return await codeToHtml(block.code, { lang: block.lang, theme: theme || 'vitesse-dark' });
+        } catch {
+            // Unknown language, fall back to plain text instead of failing the whole batch.
+            return await codeToHtml(block.code, { lang: 'text', theme: theme || 'vitesse-dark' });
+        }
+    }));
+    res.json(html);
 });
 
-app.post("/hltext", async (req, res, next) => {
-    let contents = req.body;
-    console.log(contents, req.query.lang);
-    console.log(typeof contents);
-    var html = await codeToHtml(contents.code, {
-        lang: contents.lang, theme: contents.theme || 'vitesse-dark'
-    });
-    res.send(html);
+app.get("/health", (req, res) => {
+    res.send("ok");
 });
 
-let [_, __, port] = process.argv;
-app.listen(port || 39389, () => {
-    console.log(`ShikiJS microservice running on port ${port || 39389}`);
+// Languages and themes loaded before listening, so health checks only pass once they can
+// be highlighted without waiting for their grammars. Others are loaded on first use.
+const WARM_LANGUAGES = ['py', 'js', 'ts', 'json', 'html', 'css', 'bash', 'md', 'toml', 'yaml', 'text'];
+const WARM_THEMES = ['github-dark', 'vitesse-dark'];
+await Promise.all(WARM_THEMES.flatMap((theme) => WARM_LANGUAGES.map(
+    (lang) => codeToHtml("", { lang, theme }).catch((error) => {
+        console.error(`Could not preload ${lang} with ${theme}: ${error}`);
+    })
+)));
+
+// Either a TCP port or the path of a Unix socket.
+let [_, __, address] = process.argv;
+address = address || 39389;
+if (isNaN(address)) {
+    try { unlinkSync(address); } catch { }
+}
+app.listen(address, () => {
+    console.log(`ShikiJS microservice running on ${address}`);
 });
\ No newline at end of file
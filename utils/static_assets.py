@@ -0,0 +1,213 @@
+"""Fingerprints and precompresses everything under `static/`.
+
+Built files go to `.cache/static`, named after a hash of their contents, next to
+`.br` and `.gz` variants. PNGs are recompressed losslessly instead. Run `python -m utils.static_assets` to build ahead of
+time, the app also builds on startup and only redoes files that changed.
+
+Workers build one at a time under a lock, the first one does the work and the
+others find it done. Files of earlier builds stay around for `RETIRED_KEEP`
+seconds after they were last current, pages rendered before a deploy (by a
+draining worker, or cached by a browser) still link to them.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import re
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from utils.shared_files import exclusive, write_atomic
+
+try:
+    import brotli
+except ImportError:  # Optional, gzip is enough for every browser.
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+SOURCE = Path("static")
+DESTINATION = Path(".cache/static")
+LOCK_PATH = Path(".cache/static.lock")
+#  Seconds files of earlier builds are kept after they were last part of one.
+RETIRED_KEEP = 7 * 24 * 60 * 60
+URL_PREFIX = "/assets/"
+COMPRESSIBLE = {".css", ".js", ".svg", ".ttf", ".ico", ".json", ".webmanifest", ".txt"}
+#  Files that link to other static files, and have those links pointed at the built ones.
+REWRITTEN = {".css", ".webmanifest"}
+STATIC_URL_RE = re.compile(r"/static/(?P<path>[\w./-]+)")
+#  What `fingerprinted` names look like, "styles/main.0a1b2c3d4e.css".
+FINGERPRINTED_RE = re.compile(r"[^/]+\.[0-9a-f]{10}(\.\w+)?")
+#  Smallest saving worth keeping a compressed variant for.
+MIN_SAVING = 0.1
+
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+mimetypes.add_type("font/ttf", ".ttf")
+
+
+def fingerprinted(path: str, content: bytes) -> str:
+    digest = hashlib.blake2b(content, digest_size=5).hexdigest()
+    stem, dot, suffix = path.rpartition(".")
+    return f"{stem}.{digest}.{suffix}" if dot else f"{path}.{digest}"
+
+
+def optimize_png(content: bytes) -> bytes:
+    """Losslessly recompresses a PNG, keeping the original if that is smaller."""
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            output = io.BytesIO()
+            image.save(output, "PNG", optimize=True)
+    except OSError:
+        return content
+    return min(content, output.getvalue(), key=len)
+
+
+def built_url(manifest: dict[str, str], path: str) -> str:
+    if built := manifest.get(path):
+        return URL_PREFIX + built
+    return f"/static/{path}"
+
+
+class StaticAssets:
+    def __init__(
+        self, source: Path = SOURCE, destination: Path = DESTINATION, lock_path: Path = LOCK_PATH
+    ):
+        self.source = source
+        self.destination = destination
+        self.lock_path = lock_path
+        #  "styles/main.css" -> "styles/main.0a1b2c3d4e.css"
+        self.manifest: dict[str, str] = {}
+        self.built: set[str] = set()
+        #  Built files and their compressed variants, everything that exists on disk.
+        self.served: set[str] = set()
+
+    def url(self, path: str) -> str:
+        """The fingerprinted URL of `static/<path>`, or its plain URL if it wasn't built."""
+        return built_url(self.manifest, path.removeprefix("/static/").removeprefix("/"))
+
+    def _rewrite(self, content: bytes, manifest: dict[str, str]) -> bytes:
+        return STATIC_URL_RE.sub(
+            lambda match: built_url(manifest, match.group("path")), content.decode()
+        ).encode()
+
+    def _emit(self, path: str, content: bytes) -> str:
+        built = fingerprinted(path, content)
+        target = self.destination / built
+        if not target.exists():
+            if target.suffix == ".png":
+                content = optimize_png(content)
+            write_atomic(target, content)
+            if Path(path).suffix in COMPRESSIBLE:
+                variants = {".gz": gzip.compress(content, 9, mtime=0)}
+                if brotli is not None:
+                    variants[".br"] = brotli.compress(content, quality=11)
+                for extension, compressed in variants.items():
+                    if len(compressed) <= len(content) * (1 - MIN_SAVING):
+                        write_atomic(target.with_name(target.name + extension), compressed)
+        return built
+
+    def build(self) -> dict[str, str]:
+        """Builds every asset, the new names are only used once all of them are built."""
+        with exclusive(self.lock_path):
+            files = sorted(
+                (path for path in self.source.rglob("*") if path.is_file()),
+                # Files that link to others go last, once the others have their names.
+                key=lambda path: path.suffix in REWRITTEN,
+            )
+            manifest: dict[str, str] = {}
+            for file in files:
+                path = file.relative_to(self.source).as_posix()
+                content = file.read_bytes()
+                if file.suffix in REWRITTEN:
+                    content = self._rewrite(content, manifest)
+                manifest[path] = self._emit(path, content)
+
+            served = {
+                built + extension
+                for built in manifest.values()
+                for extension in ("", ".gz", ".br")
+                if (self.destination / (built + extension)).exists()
+            }
+            # Left alone when nothing changed, pages are validated against its mtime.
+            content = json.dumps(manifest, indent=2).encode()
+            path = self.destination / "manifest.json"
+            if not path.exists() or path.read_bytes() != content:
+                write_atomic(path, content)
+            self._remove_retired(served)
+
+        self.manifest = manifest
+        self.built = set(manifest.values())
+        self.served = served
+        log.info("Built %s static assets.", len(manifest))
+        return manifest
+
+    def _remove_retired(self, served: set[str]):
+        """Marks the files of this build as current, and removes those unused for too long."""
+        now = time.time()
+        for file in self.destination.rglob("*"):
+            relative = file.relative_to(self.destination).as_posix()
+            if not file.is_file() or relative == "manifest.json" or file.name.startswith("."):
+                continue
+            try:
+                if relative in served:
+                    os.utime(file, (now, now))
+                elif now - file.stat().st_mtime > RETIRED_KEEP:
+                    file.unlink()
+            except FileNotFoundError:
+                continue
+
+    def _retired(self, path: str) -> bool:
+        """Whether `path` is a file of an earlier build that is still around."""
+        parts = path.split("/")
+        return (
+            FINGERPRINTED_RE.fullmatch(parts[-1]) is not None
+            and not any(part.startswith(".") or not part for part in parts)
+            and (self.destination / path).is_file()
+        )
+
+    def resolve(self, path: str, accept_encoding: str) -> tuple[Path, str | None] | None:
+        """The file to send for the built `path`, and its Content-Encoding."""
+        current = path in self.built
+        if not current and not self._retired(path):
+            return None
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding, extension in (("br", ".br"), ("gzip", ".gz")):
+            variant = path + extension
+            # Only the current build's variants are known, older ones are looked up.
+            if encoding in accepted and (
+                variant in self.served if current else (self.destination / variant).is_file()
+            ):
+                return self.destination / variant, encoding
+        return self.destination / path, None
+
+
+def parse_accept_encoding(header: str) -> set[str]:
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = params.strip().removeprefix("q=")
+        try:
+            if params and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def media_type(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+static_assets = StaticAssets()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    static_assets.build()
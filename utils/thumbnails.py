@@ -0,0 +1,222 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+from urllib.parse import quote
+
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from utils.shared_files import try_lock, write_atomic
+from utils.watcher import watch_changes
+
+log = logging.getLogger(__name__)
+
+WIDTHS = (320, 640, 1280)
+LOCK_PATH = Path(".cache/thumbnails.lock")
+#  Seconds between the other workers' looks at what the generating one wrote.
+FOLLOW_INTERVAL = 5
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+VARIANT_RE = re.compile(r"^(?P<name>.+)\.(?P<width>\d+)w\.(?P<format>webp|jpg)$")
+
+
+class Variants(NamedTuple):
+    """The downscaled copies of one gallery image."""
+
+    base_url: str
+    widths: tuple[int, ...]
+
+    def srcset(self, format: str) -> str:
+        return ", ".join(f"{self.base_url}.{w}w.{format} {w}w" for w in self.widths)
+
+    @property
+    def webp_srcset(self) -> str:
+        return self.srcset("webp")
+
+    @property
+    def jpeg_srcset(self) -> str:
+        return self.srcset("jpg")
+
+    @property
+    def src(self) -> str:
+        return f"{self.base_url}.{self.widths[len(self.widths) // 2]}w.jpg"
+
+
+def save_atomic(image: PILImage.Image, path: Path, format: str, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format, **options)
+    write_atomic(path, buffer.getvalue())
+
+
+def render_variants(source: Path, destination: Path, widths: tuple[int, ...]) -> tuple[int, ...]:
+    """Writes a WebP and a JPEG copy of `source` for every width up to the original's.
+
+    The JPEG goes last, a width counts as done once it exists. Runs inside the
+    process pool, so it must stay a picklable module-level function.
+    """
+    destination.mkdir(parents=True, exist_ok=True)
+    with PILImage.open(source) as image:
+        image.draft("RGB", (max(widths), max(widths)))
+        image = ImageOps.exif_transpose(image)
+        fitting = tuple(w for w in widths if w < image.width)
+        if image.width < max(widths):
+            fitting += (image.width,)
+        for width in fitting:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), PILImage.Resampling.LANCZOS)
+            if resized.mode not in ("RGB", "RGBA"):
+                resized = resized.convert("RGBA" if "A" in resized.getbands() else "RGB")
+            save_atomic(resized, destination / f"{source.name}.{width}w.webp", "WEBP", quality=80)
+            save_atomic(
+                resized.convert("RGB"),
+                destination / f"{source.name}.{width}w.jpg",
+                "JPEG",
+                quality=82,
+                optimize=True,
+                progressive=True,
+            )
+    return fitting
+
+
+class Thumbnailer:
+    """Generates and tracks responsive variants for every image under `source`.
+
+    Variants live in `destination`, mirroring the gallery folders, and are served
+    from `url_prefix` just like the originals are served from `/gallery`. One
+    worker, holding the lock, generates them. The others only load what it wrote,
+    and take over when it goes away.
+    """
+
+    def __init__(
+        self,
+        source: Path,
+        destination: Path,
+        url_prefix: str,
+        widths: tuple[int, ...] = WIDTHS,
+        workers: int | None = None,
+        lock_path: Path = LOCK_PATH,
+    ):
+        self.source = source
+        self.destination = destination
+        self.url_prefix = url_prefix
+        self.widths = widths
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self.lock_path = lock_path
+        self.variants: dict[tuple[str, str], Variants] = {}
+        self.ready = False
+
+    def get(self, folder: str, filename: str) -> Variants | None:
+        return self.variants.get((folder, filename))
+
+    def count(self, folder: str | None = None) -> int:
+        """How many images (of `folder`) have variants."""
+        if folder is None:
+            return len(self.variants)
+        return sum(1 for name, _ in self.variants if name == folder)
+
+    def _variants(self, folder: str, filename: str, widths: tuple[int, ...]) -> Variants:
+        return Variants(
+            base_url=f"{self.url_prefix}/{quote(folder)}/{quote(filename)}",
+            widths=tuple(sorted(widths)),
+        )
+
+    def _scan(self, clean: bool = True) -> list[tuple[Path, Path]]:
+        """Loads the variants already on disk, removes orphans and returns what is missing.
+
+        Without `clean`, for workers that don't generate, only loads them.
+        """
+        found: dict[tuple[str, str], Variants] = {}
+        todo: list[tuple[Path, Path]] = []
+
+        for folder in self.source.iterdir():
+            if not folder.is_dir():
+                continue
+            destination = self.destination / folder.name
+            existing: dict[str, dict[int, int]] = {}
+            if destination.is_dir():
+                for variant in destination.iterdir():
+                    match = VARIANT_RE.fullmatch(variant.name)
+                    if match and match.group("format") == "jpg":
+                        widths = existing.setdefault(match.group("name"), {})
+                        widths[int(match.group("width"))] = variant.stat().st_mtime_ns
+
+            for image in folder.iterdir():
+                if image.suffix.lower() not in IMAGE_SUFFIXES or not image.is_file():
+                    continue
+                widths = existing.pop(image.name, None)
+                if widths and min(widths.values()) >= image.stat().st_mtime_ns:
+                    found[folder.name, image.name] = self._variants(
+                        folder.name, image.name, tuple(widths)
+                    )
+                else:
+                    todo.append((image, destination))
+
+            if not clean:
+                continue
+            for name, widths in existing.items():
+                for width in widths:
+                    for format in ("webp", "jpg"):
+                        (destination / f"{name}.{width}w.{format}").unlink(missing_ok=True)
+
+        self.variants = found
+        return todo
+
+    async def generate(self, pool: ProcessPoolExecutor):
+        todo = await asyncio.to_thread(self._scan)
+        if not todo:
+            return
+
+        log.info("Generating thumbnails for %s images.", len(todo))
+        loop = asyncio.get_running_loop()
+
+        async def generate_one(image: Path, destination: Path):
+            widths = await loop.run_in_executor(
+                pool, render_variants, image, destination, self.widths
+            )
+            self.variants[image.parent.name, image.name] = self._variants(
+                image.parent.name, image.name, widths
+            )
+
+        results = await asyncio.gather(
+            *(generate_one(image, destination) for image, destination in todo),
+            return_exceptions=True,
+        )
+        for (image, _), result in zip(todo, results):
+            if isinstance(result, Exception):
+                log.error("Failed generating thumbnails for %s: %r", image, result)
+
+    async def _follow(self) -> int:
+        """Loads what the generating worker writes until it goes away, then takes over."""
+        while True:
+            try:
+                await asyncio.to_thread(self._scan, False)
+                self.ready = True
+            except OSError:
+                # Something was removed while looking, the next look will do.
+                log.warning("Failed loading thumbnails.", exc_info=True)
+            await asyncio.sleep(FOLLOW_INTERVAL)
+            if (fd := try_lock(self.lock_path)) is not None:
+                return fd
+
+    async def run(self):
+        if not self.source.is_dir():
+            log.warning("Not generating thumbnails, %s does not exist.", self.source)
+            return
+        if (fd := try_lock(self.lock_path)) is None:
+            fd = await self._follow()
+        log.info("Process %s is generating thumbnails.", os.getpid())
+        # Forking would copy the watcher threads of the parent into every worker.
+        pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            await self.generate(pool)
+            self.ready = True
+            async for _ in watch_changes(self.source):
+                await self.generate(pool)
+        finally:
+            await asyncio.to_thread(pool.shutdown, cancel_futures=True)
+            os.close(fd)
@@ -0,0 +1,245 @@
+"""Where requests spend their time, sent as Server-Timing and kept as histograms.
+
+Code worth knowing the cost of runs inside `phase("name")`. During a request,
+the phase durations are summed up for its Server-Timing header. Every phase,
+in a request or in the background, also goes into a histogram, and
+`/private/metrics` shows them to Prometheus.
+
+Every worker process keeps its own numbers and saves them to `.cache/metrics`
+every few seconds, so whichever worker answers the scrape reports all of them,
+labelled with their pid.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Iterator, Mapping
+
+import jinja2
+from litestar.enums import ScopeType
+from litestar.middleware import ASGIMiddleware
+from litestar.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.shared_files import write_atomic
+
+log = logging.getLogger(__name__)
+
+PHASES = {
+    "fs": "filesystem",
+    "markdown": "markdown",
+    "highlight": "syntax highlighting",
+    "music": "music service",
+    "lastfm": "Last.fm",
+    "template": "templates",
+}
+#  Upper bounds in seconds, the same for every histogram.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_DIR = Path(".cache/metrics")
+
+#  Milliseconds spent in every phase by the current request, None outside of one.
+REQUEST_PHASES: ContextVar[dict[str, float] | None] = ContextVar("REQUEST_PHASES", default=None)
+#  Whether a template is being rendered, templates rendered by it are already being timed.
+RENDERING: ContextVar[bool] = ContextVar("RENDERING", default=False)
+
+Stats = Callable[[], Mapping[str, float | None]]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        #  label values -> [count in every bucket and above the last one, sum]
+        self.series: dict[tuple[str, ...], list[Any]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(BUCKETS) + 1), 0.0]
+        counts = series[0]
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+        series[1] += value
+
+
+def escape_label(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Mapping[str, object]) -> str:
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+class Metrics:
+    def __init__(self, directory: Path = METRICS_DIR):
+        self.directory = directory
+        self.phases = Histogram(
+            "site_phase_seconds", "Time spent in each phase of the work.", ("phase",)
+        )
+        self.requests = Histogram(
+            "site_request_seconds", "Time to answer requests, by route.", ("route", "status")
+        )
+        self.sources: dict[str, Stats] = {}
+
+    def register(self, name: str, stats: Stats):
+        """Exposes `stats()` as `site_<name>_<stat>` gauges."""
+        self.sources[name] = stats
+
+    def snapshot(self) -> dict[str, Any]:
+        stats: dict[str, float] = {}
+        for source, collect in self.sources.items():
+            try:
+                values = collect()
+            except Exception:
+                log.exception("Failed collecting %s stats.", source)
+                continue
+            for stat, value in values.items():
+                if value is not None:
+                    stats[f"site_{source}_{stat}"] = value
+        return {
+            "pid": os.getpid(),
+            "histograms": [
+                {"name": h.name, "help": h.help, "labels": h.labels, "series": list(h.series.items())}
+                for h in (self.phases, self.requests)
+            ],
+            "stats": stats,
+        }
+
+    def save(self):
+        write_atomic(self.directory / f"{os.getpid()}.json", json.dumps(self.snapshot()).encode())
+
+    def _others(self) -> list[dict[str, Any]]:
+        snapshots = []
+        for file in self.directory.glob("*.json"):
+            # Not a worker's, and `os.kill(0, 0)` would signal our whole process group.
+            if not file.stem.isdigit() or int(file.stem) == os.getpid():
+                continue
+            pid = int(file.stem)
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                file.unlink(missing_ok=True)
+                continue
+            except PermissionError:
+                pass
+            try:
+                snapshots.append(json.loads(file.read_text()))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        """Every worker's metrics, in the Prometheus text format."""
+        snapshots = [self.snapshot(), *self._others()]
+        lines: list[str] = []
+        for index, histogram in enumerate(snapshots[0]["histograms"]):
+            name = histogram["name"]
+            lines += [f"# HELP {name} {histogram['help']}", f"# TYPE {name} histogram"]
+            for snapshot in snapshots:
+                for values, (counts, total) in snapshot["histograms"][index]["series"]:
+                    labels = dict(zip(histogram["labels"], values), pid=snapshot["pid"])
+                    cumulative = 0
+                    for bound, count in zip([*BUCKETS, "+Inf"], counts):
+                        cumulative += count
+                        bucket = format_labels({**labels, "le": bound})
+                        lines.append(f"{name}_bucket{bucket} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+        names = sorted({name for snapshot in snapshots for name in snapshot["stats"]})
+        for name in names:
+            lines.append(f"# TYPE {name} gauge")
+            for snapshot in snapshots:
+                if (value := snapshot["stats"].get(name)) is not None:
+                    lines.append(f"{name}{format_labels({'pid': snapshot['pid']})} {value}")
+        return "\n".join(lines) + "\n"
+
+    async def run(self, interval: float = 5):
+        try:
+            while True:
+                try:
+                    await asyncio.to_thread(self.save)
+                except OSError:
+                    log.exception("Failed saving metrics.")
+                await asyncio.sleep(interval)
+        finally:
+            (self.directory / f"{os.getpid()}.json").unlink(missing_ok=True)
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Times the block as `name`, for the current request and the histograms."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.phases.observe(elapsed, name)
+        if (phases := REQUEST_PHASES.get()) is not None:
+            phases[name] = phases.get(name, 0.0) + elapsed * 1000
+
+
+def server_timing(phases: Mapping[str, float], total: float) -> str:
+    entries = [
+        f'{name};desc="{PHASES.get(name, name)}";dur={duration:.2f}'
+        for name, duration in phases.items()
+    ]
+    return ", ".join([*entries, f"total;dur={total:.2f}"])
+
+
+class TimingMiddleware(ASGIMiddleware):
+    """Adds a Server-Timing header to every response, and times requests by route."""
+
+    scopes = (ScopeType.HTTP,)
+
+    async def handle(self, scope: Scope, receive: Receive, send: Send, next_app: ASGIApp):
+        started = time.perf_counter()
+        phases: dict[str, float] = {}
+        token = REQUEST_PHASES.set(phases)
+        status = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total = (time.perf_counter() - started) * 1000
+                header = server_timing(phases, total).encode()
+                message["headers"] = [*message.get("headers", []), (b"server-timing", header)]
+            await send(message)
+
+        try:
+            await next_app(scope, receive, send_with_timing)
+        finally:
+            REQUEST_PHASES.reset(token)
+            route = scope.get("path_template") or "unknown"
+            metrics.requests.observe(time.perf_counter() - started, route, str(status))
+
+
+class TimedTemplate(jinja2.Template):
+    """Counts rendering towards the "template" phase.
+
+    Includes, and templates rendered from inside another one like fragments, are
+    part of the outermost render.
+    """
+
+    def render(self, *args: Any, **kwargs: Any) -> str:
+        if RENDERING.get():
+            return super().render(*args, **kwargs)
+        token = RENDERING.set(True)
+        try:
+            with phase("template"):
+                return super().render(*args, **kwargs)
+        finally:
+            RENDERING.reset(token)
@@ -0,0 +1,61 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """Remembers fetched values for a while, and makes concurrent misses share one fetch.
+
+    `ttl_for` decides how long each value stays fresh, 0 means don't remember it.
+    Once there are more than `max_entries`, the least recently used entry goes.
+    """
+
+    def __init__(self, ttl_for: Callable[[V], float], max_entries: int = 4096):
+        self.ttl_for = ttl_for
+        self.max_entries = max_entries
+        self.entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self.pending: dict[K, asyncio.Task[V]] = {}
+        self.hits = self.misses = self.coalesced = self.evictions = 0
+
+    async def _fetch(self, key: K, fetch: Callable[[], Awaitable[V]]) -> V:
+        value = await fetch()
+        if (ttl := self.ttl_for(value)) > 0:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    async def get(self, key: K, fetch: Callable[[], Awaitable[V]]) -> V:
+        if (entry := self.entries.get(key)) is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return value
+            del self.entries[key]
+
+        if task := self.pending.get(key):
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self.pending[key] = asyncio.create_task(self._fetch(key, fetch))
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        # Shielded, so one client hanging up doesn't fail everyone waiting on the fetch.
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
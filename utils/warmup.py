@@ -0,0 +1,71 @@
+"""Gets a worker warm before it takes requests, and tells how warm it is.
+
+The lifespan runs every warm-up step in turn before the server starts taking
+requests, logging how long each took. Steps that can go cold again later, like
+the highlighter losing all its workers, also register a live check. Both make
+up the report at `/private/ready`, which a load balancer can poll to only send
+traffic to instances that are ready.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, NamedTuple
+
+log = logging.getLogger(__name__)
+
+
+class Step(NamedTuple):
+    status: str  # "ready" or "failed"
+    seconds: float
+
+
+class Warmup:
+    def __init__(self):
+        self.steps: dict[str, Step] = {}
+        self.checks: dict[str, Callable[[], bool]] = {}
+        self.seconds: float | None = None
+
+    async def step(self, name: str, warm: Callable[[], Awaitable[Any]]):
+        """Runs `warm()`, the step failed if it raised. Later steps run either way."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await warm()
+        except Exception:
+            seconds = loop.time() - started
+            log.exception("Warming up %s failed after %.2fs.", name, seconds)
+            self.steps[name] = Step("failed", seconds)
+        else:
+            seconds = loop.time() - started
+            log.info("Warmed up %s in %.2fs.", name, seconds)
+            self.steps[name] = Step("ready", seconds)
+
+    def check(self, name: str, ready: Callable[[], bool]):
+        """Reports `name` as ready only while `ready()` says so, after its step."""
+        self.checks[name] = ready
+
+    def finish(self, seconds: float):
+        self.seconds = seconds
+        log.info("Warm-up finished in %.2fs.", seconds)
+
+    def status(self, name: str) -> str:
+        if (step := self.steps.get(name)) is None:
+            return "pending"
+        if step.status == "ready" and (check := self.checks.get(name)) and not check():
+            return "unavailable"
+        return step.status
+
+    def report(self) -> dict[str, Any]:
+        components = {
+            name: {"status": self.status(name), "seconds": round(step.seconds, 3)}
+            for name, step in self.steps.items()
+        }
+        return {
+            "ready": self.seconds is not None
+            and all(component["status"] == "ready" for component in components.values()),
+            "seconds": self.seconds and round(self.seconds, 3),
+            "components": components,
+        }
+
+
+warmup = Warmup()
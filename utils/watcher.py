@@ -0,0 +1,38 @@
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+log = logging.getLogger(__name__)
+
+
+def _snapshot(directory: Path) -> dict[str, int]:
+    return {root: os.stat(root).st_mtime_ns for root, _, _ in os.walk(directory)}
+
+
+async def watch_changes(directory: Path, poll_interval: float = 2):
+    """Yields every time something inside `directory` is added, removed or modified.
+
+    Uses inotify through watchfiles when it is installed, and falls back to
+    polling the mtimes of the folders (which only catches additions and removals).
+    """
+    if not directory.is_dir():
+        log.warning("Not watching %s, it is not a directory.", directory)
+        return
+
+    if watchfiles is not None:
+        async for _ in watchfiles.awatch(directory):
+            yield
+        return
+
+    last = await asyncio.to_thread(_snapshot, directory)
+    while True:
+        await asyncio.sleep(poll_interval)
+        if (current := await asyncio.to_thread(_snapshot, directory)) != last:
+            last = current
+            yield
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import NamedTuple
+from xml.etree import ElementTree
+
+from utils.conditional import Validator
+from utils.render_cache import RenderCache, RenderedFile
+from utils.weblog_index import File, WeblogIndex
+
+log = logging.getLogger(__name__)
+
+TITLE = "Leo's Collection of Random."
+AUTHOR = "Leo"
+ATOM_NS = "http://www.w3.org/2005/Atom"
+XML_BASE = "{http://www.w3.org/XML/1998/namespace}base"
+
+
+class Feed(NamedTuple):
+    body: bytes
+    media_type: str
+    validator: Validator
+
+
+class Entry(NamedTuple):
+    file: File
+    rendered: RenderedFile
+
+    @property
+    def published(self) -> str:
+        return f"{self.file.date}T00:00:00Z"
+
+    @property
+    def updated(self) -> str:
+        modified = datetime.fromtimestamp(self.rendered.mtime_ns / 1e9, timezone.utc)
+        return max(modified.isoformat(timespec="seconds"), self.published)
+
+
+class WeblogFeed:
+    """Atom and JSON feeds of the newest weblog posts, with their full content.
+
+    Both are built from the render cache, kept in memory, and only built again
+    when a post in them is added, removed or re-rendered.
+    """
+
+    def __init__(self, index: WeblogIndex, cache: RenderCache, site_url: str, entries: int):
+        self.index = index
+        self.cache = cache
+        self.site_url = site_url.rstrip("/")
+        self.entries = entries
+        self.key: tuple[tuple[str, int], ...] | None = None
+        self.feeds: dict[str, Feed] = {}
+
+    def newest(self) -> list[tuple[File, Path]]:
+        posts: list[tuple[File, Path]] = []
+        for folder in self.index.folders:
+            for file in folder.files:
+                year, _, slug = file.href.removeprefix("/weblog/").partition("/")
+                if path := self.index.post(year, slug):
+                    posts.append((file, path))
+                if len(posts) == self.entries:
+                    return posts
+        return posts
+
+    async def get(self, kind: str) -> Feed:
+        """The current "atom" or "json" feed."""
+        entries: list[Entry] = []
+        for file, path in self.newest():
+            if (rendered := self.cache.entry(path)) is None:
+                try:
+                    await self.cache.load(path)
+                except Exception:
+                    # Left out for now, the background refresh will retry.
+                    log.exception("Failed rendering %s for the feed.", path)
+                    continue
+                rendered = self.cache.entry(path)
+            if rendered is not None:
+                entries.append(Entry(file, rendered))
+
+        key = tuple((entry.file.href, entry.rendered.mtime_ns) for entry in entries)
+        if key != self.key:
+            newest_ns = max((entry.rendered.mtime_ns for entry in entries), default=0)
+            self.feeds = {
+                "atom": self._feed(self._atom(entries), "application/atom+xml", newest_ns),
+                "json": self._feed(self._json(entries), "application/feed+json", newest_ns),
+            }
+            self.key = key
+        return self.feeds[kind]
+
+    @staticmethod
+    def _feed(body: bytes, media_type: str, mtime_ns: int) -> Feed:
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        return Feed(body, media_type, Validator.of(mtime_ns, digest))
+
+    def _atom(self, entries: list[Entry]) -> bytes:
+        feed = ElementTree.Element("feed", {"xmlns": ATOM_NS, XML_BASE: self.site_url + "/"})
+
+        def add(parent: ElementTree.Element, tag: str, text: str = "", **attributes: str):
+            element = ElementTree.SubElement(parent, tag, attributes)
+            element.text = text or None
+            return element
+
+        add(feed, "id", f"{self.site_url}/weblog")
+        add(feed, "title", f"{TITLE} weblog")
+        add(feed, "updated", max((e.updated for e in entries), default="1970-01-01T00:00:00Z"))
+        add(add(feed, "author"), "name", AUTHOR)
+        add(feed, "link", rel="alternate", type="text/html", href=f"{self.site_url}/weblog")
+        add(feed, "link", rel="self", href=f"{self.site_url}/weblog/feed.atom")
+
+        for entry in entries:
+            url = self.site_url + entry.file.href
+            element = add(feed, "entry")
+            add(element, "id", url)
+            add(element, "title", entry.file.title)
+            add(element, "published", entry.published)
+            add(element, "updated", entry.updated)
+            add(element, "link", rel="alternate", type="text/html", href=url)
+            add(element, "content", str(entry.rendered.html), type="html")
+
+        return ElementTree.tostring(feed, encoding="utf-8", xml_declaration=True)
+
+    def _json(self, entries: list[Entry]) -> bytes:
+        feed = {
+            "version": "https://jsonfeed.org/version/1.1",
+            "title": f"{TITLE} weblog",
+            "home_page_url": f"{self.site_url}/weblog",
+            "feed_url": f"{self.site_url}/weblog/feed.json",
+            "authors": [{"name": AUTHOR}],
+            "items": [
+                {
+                    "id": self.site_url + entry.file.href,
+                    "url": self.site_url + entry.file.href,
+                    "title": entry.file.title,
+                    "content_html": str(entry.rendered.html),
+                    "date_published": entry.published,
+                    "date_modified": entry.updated,
+                }
+                for entry in entries
+            ],
+        }
+        return json.dumps(feed, ensure_ascii=False).encode()
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import re
+from pathlib import Path
+from typing import NamedTuple
+
+from utils.watcher import watch_changes
+
+log = logging.getLogger(__name__)
+
+WEBLOG_YEARS_DIR = Path("./weblog")
+FILE_NAME_RE = re.compile(
+    r"^(?P<month>\d{2})-(?P<day>\d{2})(?:-(?P<title>[\w\-]+))?(:?\.md)?$"
+)
+
+
+class File(NamedTuple):
+    date: str
+    month: str
+    day: str
+    href: str
+    title: str
+
+
+class WeblogFolder(NamedTuple):
+    year: str
+    files: list[File]
+
+
+def post_title(slug_title: str | None, date: str) -> str:
+    """The title spelled out by a post's file name, its date if the name has none."""
+    return slug_title.replace("-", " ").title() if slug_title else date
+
+
+def get_files_from(folder: Path):
+    files: list[File] = []
+    for file in sorted(folder.iterdir(), key=lambda f: f.name, reverse=True):
+        if not file.is_file():
+            continue
+        match = FILE_NAME_RE.fullmatch(file.name)
+        if not match:
+            continue
+        year = folder.name
+        month = match.group("month")
+        day = match.group("day")
+        title = match.group("title")
+        slug = f"{month}-{day}-{title}" if title else f"{month}-{day}"
+        files.append(
+            File(
+                date=f"{year}-{month}-{day}",
+                title=post_title(title, f"{year}-{month}-{day}"),
+                day=day,
+                month=month,
+                href=f"/weblog/{year}/{slug}",
+            )
+        )
+    return files
+
+
+class WeblogIndex:
+    """Every weblog post, indexed once and rebuilt only when `weblog/` changes.
+
+    Scheme: `/Year/Month-Day-title-of-the-log.md`
+    """
+
+    def __init__(self, directory: Path = WEBLOG_YEARS_DIR):
+        self.directory = directory
+        self.folders: list[WeblogFolder] = []
+        self.years: dict[str, WeblogFolder] = {}
+        self.posts: dict[tuple[str, str], Path] = {}
+        self.by_date: dict[tuple[str, str, str], str] = {}
+        self.version = 0
+        #  Newest mtime of the weblog folder and its year folders, i.e. of the listing.
+        self.mtime_ns = 0
+
+    def rebuild(self):
+        years: dict[str, WeblogFolder] = {}
+        posts: dict[tuple[str, str], Path] = {}
+        by_date: dict[tuple[str, str, str], str] = {}
+        mtime_ns = self.directory.stat().st_mtime_ns
+
+        for folder in sorted(self.directory.iterdir(), key=lambda d: d.name, reverse=True):
+            if not folder.is_dir() or not (folder.name.isnumeric() and len(folder.name) == 4):
+                continue
+            year = folder.name
+            mtime_ns = max(mtime_ns, folder.stat().st_mtime_ns)
+            years[year] = WeblogFolder(year=year, files=get_files_from(folder))
+            for file in years[year].files:
+                slug = file.href.rpartition("/")[2]
+                posts[year, slug] = folder / f"{slug}.md"
+                by_date.setdefault((year, file.month, file.day), slug)
+
+        self.years, self.posts, self.by_date = years, posts, by_date
+        self.mtime_ns = mtime_ns
+        self.folders = [folder for folder in years.values() if folder.files]
+        self.version += 1
+
+    def paths(self):
+        return list(self.posts.values())
+
+    def post(self, year: str, slug: str) -> Path | None:
+        return self.posts.get((year, slug))
+
+    def canonical_slug(self, year: str, month: str, day: str) -> str | None:
+        return self.by_date.get((year, month, day))
+
+    async def watch(self):
+        """Rebuilds the index whenever anything under the weblog folder changes."""
+        async for _ in watch_changes(self.directory):
+            await self._rebuild_safely()
+
+    async def _rebuild_safely(self):
+        # Anything escaping would end `watch`, and the index would never update again.
+        try:
+            await asyncio.to_thread(self.rebuild)
+        except Exception:
+            log.exception("Failed rebuilding the weblog index.")
+
+
+weblog_index = WeblogIndex()
@@ -0,0 +1,242 @@
+import asyncio
+import gzip
+import html
+import json
+import logging
+import math
+import re
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+from typing import NamedTuple
+
+import mistune
+from markupsafe import Markup, escape
+
+from utils.shared_files import write_atomic
+from utils.weblog_index import File, WeblogIndex, weblog_index
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = Path(".cache/weblog-search.json.gz")
+TOKEN_RE = re.compile(r"\w+")
+TAG_RE = re.compile(r"<[^>]+>")
+#  Title words count this many times as much as words in the body.
+TITLE_WEIGHT = 3
+#  BM25 parameters.
+K1, B = 1.2, 0.75
+#  The last word of a query also matches words it is the start of, up to this many.
+MAX_PREFIX_TERMS = 32
+#  Score of those words, relative to the word as typed.
+PREFIX_WEIGHT = 0.5
+SNIPPET_CHARS = 160
+
+plain_markdown = mistune.create_markdown()
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def plain_text(markdown: str) -> str:
+    rendered = plain_markdown(markdown)
+    return " ".join(html.unescape(TAG_RE.sub(" ", rendered)).split())  # type: ignore
+
+
+class Document(NamedTuple):
+    path: str
+    mtime_ns: int
+    href: str
+    title: str
+    date: str
+    text: str
+    frequencies: dict[str, int]
+    length: int
+
+
+class Snapshot(NamedTuple):
+    documents: dict[str, Document]
+    #  term -> {document path: weighted term frequency}
+    postings: dict[str, dict[str, int]]
+    terms: list[str]
+    average_length: float
+
+
+class Result(NamedTuple):
+    href: str
+    title: str
+    date: str
+    snippet: Markup
+    score: float
+
+
+def terms_pattern(terms: set[str]) -> re.Pattern[str]:
+    """Matches any of `terms` as a whole word."""
+    alternatives = "|".join(map(re.escape, sorted(terms, key=len, reverse=True)))
+    return re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)", re.IGNORECASE)
+
+
+def snippet(text: str, pattern: re.Pattern[str]) -> Markup:
+    """A window of `text` around the first match of `pattern`, with every match marked."""
+    first = pattern.search(text)
+    start = max(0, first.start() - SNIPPET_CHARS // 3) if first else 0
+    stop = start + SNIPPET_CHARS
+    if start:
+        # Don't start in the middle of a word.
+        start = text.find(" ", start) + 1 or start
+
+    parts: list[str] = ["…" if start else ""]
+    position = start
+    # Only the window is scanned, posts can be long and there are many results.
+    for match in pattern.finditer(text, start):
+        if match.end() > stop:
+            break
+        parts.append(escape(text[position : match.start()]))
+        parts.append(Markup("<mark>%s</mark>") % match.group())
+        position = match.end()
+    parts.append(escape(text[position:stop]))
+    if stop < len(text):
+        parts.append("…")
+    return Markup("").join(parts)
+
+
+class WeblogSearch:
+    """An inverted index of the weblog, ranked with BM25.
+
+    Documents are stored on disk with their term frequencies, so a restart only
+    re-reads posts whose mtime changed. The postings are rebuilt from them in memory,
+    and swapped in together with the documents so searches never see half an update.
+    """
+
+    def __init__(self, index: WeblogIndex = weblog_index, path: Path = INDEX_FILE):
+        self.index = index
+        self.path = path
+        self.snapshot = Snapshot({}, {}, [], 0.0)
+
+    def _load(self) -> dict[str, Document]:
+        try:
+            with gzip.open(self.path, "rt") as file:
+                return {document[0]: Document(*document) for document in json.load(file)}
+        except (OSError, ValueError, TypeError):
+            return {}
+
+    def _save(self, documents: dict[str, Document]):
+        content = json.dumps(list(documents.values()), separators=(",", ":")).encode()
+        # Every worker saves on startup, so each writes its own temporary file.
+        write_atomic(self.path, gzip.compress(content, mtime=0))
+
+    def _document(self, file: Path, mtime_ns: int, entry: File) -> Document:
+        text = plain_text(file.read_text())
+        frequencies = Counter(tokenize(text))
+        for token in tokenize(entry.title):
+            frequencies[token] += TITLE_WEIGHT
+        return Document(
+            path=str(file),
+            mtime_ns=mtime_ns,
+            href=entry.href,
+            title=entry.title,
+            date=entry.date,
+            text=text,
+            frequencies=dict(frequencies),
+            length=sum(frequencies.values()),
+        )
+
+    @staticmethod
+    def _snapshot(documents: dict[str, Document]) -> Snapshot:
+        postings: dict[str, dict[str, int]] = {}
+        for document in documents.values():
+            for term, frequency in document.frequencies.items():
+                postings.setdefault(term, {})[document.path] = frequency
+        lengths = [document.length for document in documents.values()]
+        average_length = sum(lengths) / len(lengths) if lengths else 0.0
+        return Snapshot(documents, postings, sorted(postings), average_length)
+
+    def refresh(self) -> bool:
+        """Re-reads new and changed posts and drops deleted ones. Returns whether anything changed."""
+        first = not self.snapshot.documents
+        documents = self._load() if first else dict(self.snapshot.documents)
+        changed = False
+        seen: set[str] = set()
+        entries = {file.href: file for folder in self.index.folders for file in folder.files}
+        for (year, slug), file in list(self.index.posts.items()):
+            try:
+                mtime_ns = file.stat().st_mtime_ns
+                document = documents.get(str(file))
+                if document is None or document.mtime_ns != mtime_ns:
+                    entry = entries[f"/weblog/{year}/{slug}"]
+                    documents[str(file)] = self._document(file, mtime_ns, entry)
+                    changed = True
+            except (OSError, KeyError, UnicodeDecodeError):
+                log.exception("Failed indexing %s for search.", file)
+                continue
+            seen.add(str(file))
+        for path in documents.keys() - seen:
+            del documents[path]
+            changed = True
+
+        if changed or first:
+            self.snapshot = self._snapshot(documents)
+        if changed:
+            self._save(documents)
+        return changed
+
+    def expand(self, terms: list[str], term: str) -> list[str]:
+        """Indexed `terms` starting with `term`."""
+        start = bisect_left(terms, term)
+        matches = []
+        for candidate in terms[start : start + MAX_PREFIX_TERMS]:
+            if not candidate.startswith(term):
+                break
+            matches.append(candidate)
+        return matches
+
+    def search(self, query: str, limit: int = 20) -> list[Result]:
+        snapshot = self.snapshot
+        tokens = tokenize(query)
+        if not tokens or not snapshot.documents:
+            return []
+        # Results update as you type, so the last word may not be finished yet.
+        weights = dict.fromkeys(self.expand(snapshot.terms, tokens[-1]), PREFIX_WEIGHT)
+        weights.update(dict.fromkeys(tokens, 1.0))
+
+        count = len(snapshot.documents)
+        scores: Counter[str] = Counter()
+        for term, weight in weights.items():
+            postings = snapshot.postings.get(term)
+            if not postings:
+                continue
+            idf = weight * math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for path, frequency in postings.items():
+                length = snapshot.documents[path].length
+                norm = K1 * (1 - B + B * length / snapshot.average_length)
+                scores[path] += idf * frequency * (K1 + 1) / (frequency + norm)
+
+        results = []
+        pattern = terms_pattern(set(weights))
+        for path, score in scores.most_common(limit):
+            document = snapshot.documents[path]
+            results.append(
+                Result(
+                    href=document.href,
+                    title=document.title,
+                    date=document.date,
+                    snippet=snippet(document.text, pattern),
+                    score=score,
+                )
+            )
+        return results
+
+    def stats(self) -> dict[str, int]:
+        snapshot = self.snapshot
+        return {"documents": len(snapshot.documents), "terms": len(snapshot.terms)}
+
+    async def run(self, interval: float = 5):
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception:
+                log.exception("Failed refreshing the weblog search index.")
+            await asyncio.sleep(interval)
+
+
+weblog_search = WeblogSearch()